@@ -0,0 +1,29 @@
+# frappe_ai/api/json_utils.py
+
+"""
+Fast JSON helpers for the MCP / LLM hot paths.
+
+Uses orjson when it is available (it ships with Frappe) and falls back to the
+stdlib json module otherwise. `dumps` always returns bytes so the result can be
+passed straight to `requests` as the request body.
+"""
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import json
+
+
+def dumps(obj) -> bytes:
+    """Serializes `obj` to compact UTF-8 encoded JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads(data):
+    """Parses JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
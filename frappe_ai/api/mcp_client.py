@@ -2,29 +2,60 @@
 
 import frappe
 import requests
-import json
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from frappe_ai.api import json_utils
 
-def _make_mcp_post_request(url: str, payload: dict, timeout: int) -> dict:
+# Sessions are kept per thread so every MCP call made by a worker reuses the
+# same keep-alive connection instead of opening a new one per request.
+_session_local = threading.local()
+
+# Upper bound on concurrent requests when several tools are called at once.
+MAX_PARALLEL_TOOL_CALLS = 8
+
+# Long-lived pool for tool fan-out. Its threads (and so their keep-alive
+# sessions) survive between batches; threads are only spawned on first use.
+_tool_call_pool = ThreadPoolExecutor(max_workers=MAX_PARALLEL_TOOL_CALLS, thread_name_prefix="mcp-tool")
+
+# The tool catalog only changes when the MCP server restarts, which clears this key.
+MCP_TOOL_CATALOG_CACHE_KEY = "mcp_tool_catalog"
+MCP_TOOL_CATALOG_TTL = 300
+
+def _get_mcp_session() -> requests.Session:
     """
-    A helper function to make a precise, minimal HTTP POST request.
+    Returns this thread's MCP session, creating it on first use.
     """
-    # Create a new session for each request to ensure no headers are reused.
-    session = requests.Session()
-    
-    # Clear any default headers (like User-Agent, Accept-Encoding) from the session.
-    session.headers.clear()
+    session = getattr(_session_local, "session", None)
+    if session is None:
+        session = requests.Session()
 
-    # Set ONLY the headers the MCP server strictly requires.
-    session.headers.update({
-        "Content-Type": "application/json",
-        "Accept": "application/json, text/event-stream"
-    })
+        # Clear any default headers (like User-Agent, Accept-Encoding) from the session.
+        session.headers.clear()
+
+        # Set ONLY the headers the MCP server strictly requires.
+        session.headers.update({
+            "Content-Type": "application/json",
+            "Accept": "application/json, text/event-stream"
+        })
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+        _session_local.session = session
+
+    return session
+
+def _make_mcp_post_request(url: str, payload: dict, timeout: int, log_errors: bool = True) -> dict:
+    """
+    A helper function to make a precise, minimal HTTP POST request.
+    Pass `log_errors=False` when calling from a worker thread, where the
+    Frappe request context (and its DB connection) is not available.
+    """
+    session = _get_mcp_session()
 
     try:
-        response = session.post(url, data=json.dumps(payload), timeout=timeout)
+        response = session.post(url, data=json_utils.dumps(payload), timeout=timeout)
         response.raise_for_status()
-        return response.json()
+        return json_utils.loads(response.content)
 
     except requests.exceptions.Timeout:
         raise TimeoutError(f"Request to MCP server at {url} timed out.")
@@ -34,19 +65,31 @@ def _make_mcp_post_request(url: str, payload: dict, timeout: int) -> dict:
         # Re-raise HTTP errors with a more specific message
         raise e.__class__(f"{e.response.status_code} Client Error: {e.response.reason} for url: {url}")
     except Exception as e:
-        frappe.log_error(f"Error communicating with MCP server: {e}", "MCP Client")
+        if log_errors:
+            frappe.log_error(f"Error communicating with MCP server: {e}", "MCP Client")
         raise
 
-def call_mcp_tool(tool_name: str, arguments: dict, timeout: int = 20) -> dict:
+def _get_mcp_server_url() -> str:
     """
-    Connects to the running MCP server via HTTP and calls a tool.
+    Reads only the MCP server URL from AI Settings, served from the
+    single-value cache so MCP calls don't load the whole settings document.
     """
     try:
-        settings = frappe.get_single("AI Setting")
-        url = settings.mcp_server_url
+        url = frappe.db.get_single_value("AI Setting", "mcp_server_url", cache=True)
     except Exception:
         raise ConnectionError("Could not get MCP server port from AI Settings.")
 
+    if not url:
+        raise ConnectionError("MCP Server URL is not set in AI Settings.")
+
+    return url
+
+def call_mcp_tool(tool_name: str, arguments: dict, timeout: int = 20) -> dict:
+    """
+    Connects to the running MCP server via HTTP and calls a tool.
+    """
+    url = _get_mcp_server_url()
+
     request_id = str(uuid.uuid4())
     payload = {
         "jsonrpc": "2.0",
@@ -55,7 +98,7 @@ def call_mcp_tool(tool_name: str, arguments: dict, timeout: int = 20) -> dict:
         "id": request_id,
     }
 
-    frappe.log_error(f"MCP Test: Sending payload to MCP server: {payload}", "MCP Test")
+    frappe.logger("mcp").debug("Sending payload to MCP server: %s", payload)
     response_json = _make_mcp_post_request(url, payload, timeout)
 
     if response_json.get("id") != request_id:
@@ -63,15 +106,47 @@ def call_mcp_tool(tool_name: str, arguments: dict, timeout: int = 20) -> dict:
         
     return response_json
 
+def call_mcp_tools(calls: list, timeout: int = 20, parallel: bool = True) -> list:
+    """
+    Calls several MCP tools concurrently over the shared keep-alive sessions
+    (or one after another, in order, when `parallel` is False).
+    `calls` is a list of (tool_name, arguments) tuples. Returns one entry per
+    call, in the same order: the JSON-RPC response, or the exception it raised.
+    """
+    if not calls:
+        return []
+
+    url = _get_mcp_server_url()
+    payloads = [
+        {
+            "jsonrpc": "2.0",
+            "method": "tools/call",
+            "params": {"name": tool_name, "arguments": arguments},
+            "id": str(uuid.uuid4()),
+        }
+        for tool_name, arguments in calls
+    ]
+
+    def _call(payload: dict):
+        # Runs in a worker thread: no frappe.* calls in here.
+        try:
+            response_json = _make_mcp_post_request(url, payload, timeout, log_errors=False)
+            if response_json.get("id") != payload["id"]:
+                raise ConnectionError("Error: Received response with a mismatched ID.")
+            return response_json
+        except Exception as e:
+            return e
+
+    if len(payloads) == 1 or not parallel:
+        return [_call(payload) for payload in payloads]
+
+    return list(_tool_call_pool.map(_call, payloads))
+
 def list_mcp_tools(timeout: int = 20) -> dict:
     """
     Connects to the running MCP server via HTTP and lists available tools.
     """
-    try:
-        settings = frappe.get_single("AI Setting")
-        url = settings.mcp_server_url
-    except Exception:
-        raise ConnectionError("Could not get MCP server port from AI Settings.")
+    url = _get_mcp_server_url()
 
     request_id = str(uuid.uuid4())
     payload = {
@@ -92,11 +167,7 @@ def read_mcp_resource(uri: str, timeout: int = 20) -> dict:
     """
     Connects to the MCP server and reads a resource by its URI.
     """
-    try:
-        settings = frappe.get_single("AI Setting")
-        url = settings.mcp_server_url
-    except Exception:
-        raise ConnectionError("Could not get MCP server port from AI Settings.")
+    url = _get_mcp_server_url()
 
     request_id = str(uuid.uuid4())
     payload = {
@@ -106,10 +177,28 @@ def read_mcp_resource(uri: str, timeout: int = 20) -> dict:
         "id": request_id,
     }
 
-    frappe.log_error(f"MCP Test: Sending payload to MCP server: {payload}", "MCP Test")
+    frappe.logger("mcp").debug("Sending payload to MCP server: %s", payload)
     response_json = _make_mcp_post_request(url, payload, timeout)
 
     if response_json.get("id") != request_id:
         raise ConnectionError("Error: Received response with a mismatched ID.")
             
-    return response_json
\ No newline at end of file
+    return response_json
+
+def get_cached_mcp_tools(timeout: int = 20) -> dict:
+    """
+    Returns the `result` of tools/list, served from the site cache when warm.
+    A JSON-RPC error is raised as ConnectionError and never cached.
+    """
+    catalog = frappe.cache().get_value(MCP_TOOL_CATALOG_CACHE_KEY)
+    if catalog is None:
+        response = list_mcp_tools(timeout=timeout)
+        if "result" not in response:
+            raise ConnectionError(f"MCP tools/list failed: {response.get('error')}")
+        catalog = response["result"]
+        frappe.cache().set_value(MCP_TOOL_CATALOG_CACHE_KEY, catalog, expires_in_sec=MCP_TOOL_CATALOG_TTL)
+    return catalog
+
+def clear_mcp_tool_cache():
+    """Drops the cached tool catalog, e.g. after the MCP server is restarted."""
+    frappe.cache().delete_value(MCP_TOOL_CATALOG_CACHE_KEY)
@@ -1,5 +1,7 @@
 import frappe
 import requests
+from werkzeug.wrappers import Response
+from frappe_ai.api import json_utils
 
 CURATED_MODELS = [
     {
@@ -34,12 +36,16 @@ CURATED_MODELS = [
     }
 ]
 
+# The list is static, so the `frappe.call` response body is encoded once at import.
+_CURATED_MODELS_RESPONSE_BODY = json_utils.dumps({"message": CURATED_MODELS})
+
 @frappe.whitelist()
 def get_curated_models():
     """
     A simple function that returns the hardcoded list of models.
+    Returns a ready-made response so Frappe doesn't re-encode the list on every call.
     """
-    return CURATED_MODELS
+    return Response(_CURATED_MODELS_RESPONSE_BODY, content_type="application/json")
 
 @frappe.whitelist()
 def run_model_test(model_id: str):
@@ -5,8 +5,12 @@ import subprocess
 import os
 import signal
 from typing import Dict, Any, Optional
-from frappe_ai.api.mcp_client import call_mcp_tool, list_mcp_tools
+from frappe_ai.api.mcp_client import call_mcp_tool, list_mcp_tools, clear_mcp_tool_cache
 
+# MCP server processes started by this worker, keyed by PID. Holding on to the
+# Popen handle lets us check and reap our own children without going through
+# the PID (which the OS may recycle).
+_MCP_CHILDREN: Dict[int, subprocess.Popen] = {}
 
 def get_mcp_server_settings() -> Optional[Dict[str, str]]:
     """
@@ -36,13 +40,39 @@ def get_mcp_server_settings() -> Optional[Dict[str, str]]:
         frappe.log_error(f"MCP Watchdog: Could not retrieve AI Settings: {e}", "MCP Task")
         return None
 
-def is_process_running(pid: int) -> bool:
+def is_process_running(pid: int, command: str = None) -> bool:
     """
     Check if a process with the given PID is running.
-    This works on Unix-like systems (Linux, macOS).
+    On Linux this reads /proc, so zombies count as dead and, when `command` is
+    given, a recycled PID now owned by another program is not mistaken for the
+    MCP server. Other Unix-like systems (macOS) fall back to signal 0.
     """
     if not pid:
         return False
+
+    child = _MCP_CHILDREN.get(pid)
+    if child is not None:
+        if child.poll() is None:
+            return True
+        # Already reaped by poll(); forget it so the PID can't be confused later.
+        _MCP_CHILDREN.pop(pid, None)
+        return False
+
+    if os.path.isdir("/proc/self"):
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                stat = f.read()
+            # The state field follows the parenthesised name, which may contain spaces.
+            if stat[stat.rindex(b")") + 2:][:1] == b"Z":
+                return False
+            if not command:
+                return True
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                argv = f.read().split(b"\0")
+            return _cmdline_matches(argv, command)
+        except (OSError, ValueError):
+            return False
+
     try:
         # Sending signal 0 to a process checks if it exists without harming it.
         os.kill(pid, 0)
@@ -51,6 +81,33 @@ def is_process_running(pid: int) -> bool:
     else:
         return True
 
+# Launchers and interpreters that name no program in particular; a recycled
+# PID running any of them must not pass for the MCP server.
+_GENERIC_PROGRAMS = frozenset({
+    b"node", b"nodejs", b"npm", b"npx", b"pnpm", b"yarn", b"bun", b"bunx", b"deno",
+    b"python", b"python3", b"uv", b"uvx", b"sh", b"bash", b"env", b"exec",
+})
+
+def _cmdline_matches(argv: list, command: str) -> bool:
+    """
+    Checks a process' argv against the configured server command. Launchers
+    such as `npx` re-exec under another name, and npm rewrites the process
+    title into a single space-separated argv element ("npm exec <pkg>"), so
+    the elements are split on whitespace and any shared program/script name
+    other than a generic launcher or interpreter counts as a match.
+    """
+    expected = {
+        os.path.basename(token).encode() for token in command.split() if not token.startswith("-")
+    } - _GENERIC_PROGRAMS
+    if not expected:
+        # Nothing distinctive to compare against; the PID being alive is all we can check.
+        return True
+    return any(
+        os.path.basename(token) in expected
+        for arg in argv if arg
+        for token in arg.split()
+    )
+
 def start_new_mcp_process(settings: Dict[str, str]):
     """
     Launches a new MCP server process and creates a log document for it.
@@ -66,14 +123,15 @@ def start_new_mcp_process(settings: Dict[str, str]):
 
     try:
         command = settings["mcp_server_command"].split()
-        with open(log_file_path, "w") as log_file:
+        # The child writes straight to the file descriptor; we never read its
+        # output, so no text decoding or line buffering is set up on our side.
+        with open(log_file_path, "wb", buffering=0) as log_file:
             process = subprocess.Popen(
                 command,
-                stdout=log_file,
+                stdout=log_file.fileno(),
                 stderr=subprocess.STDOUT,
                 env=env,
-                text=True,
-                bufsize=1
+                close_fds=True
             )
 
         # Create a new log document in our custom DocType
@@ -86,6 +144,10 @@ def start_new_mcp_process(settings: Dict[str, str]):
         log_doc.insert(ignore_permissions=True)
         frappe.db.commit()
 
+        _MCP_CHILDREN[process.pid] = process
+        # A new server may expose a different tool set.
+        clear_mcp_tool_cache()
+
         frappe.log_error(f"MCP Watchdog: Started new MCP server process with PID {process.pid}. Log: {log_file_path}", "MCP Task")
         return process
 
@@ -95,22 +157,34 @@ def start_new_mcp_process(settings: Dict[str, str]):
 
 def stop_all_mcp_processes():
     """Stops all running MCP server processes logged in the database."""
-    running_docs = frappe.get_all("MCP Server Process", filters={"status": "Running"}, fields=["name", "pid"])
+    running_docs = frappe.get_all("MCP Server Process", filters={"status": "Running"}, fields=["name", "pid", "command"])
     if not running_docs:
         return
 
     frappe.log_error(f"MCP Watchdog: Found {len(running_docs)} running process(es) in the database. Stopping them...", "MCP Task")
     for doc in running_docs:
-        if doc.pid and is_process_running(doc.pid):
+        child = _MCP_CHILDREN.pop(doc.pid, None)
+        if child is not None:
+            # Our own child: terminate and wait so it doesn't linger as a zombie.
+            child.terminate()
+            try:
+                child.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                child.kill()
+                child.wait()
+        elif doc.pid and is_process_running(doc.pid, doc.command):
             try:
                 os.kill(doc.pid, signal.SIGTERM)
             except OSError as e:
                 frappe.log_error(f"MCP Watchdog: Could not stop process {doc.pid}: {e}", "MCP Task")
 
-        # Mark as stopped regardless of whether it was running, to clean up the DB state
-        frappe.db.set_value("MCP Server Process", doc.name, "status", "Stopped")
-        frappe.db.set_value("MCP Server Process", doc.name, "stopped_on", frappe.utils.now_datetime())
-    
+    # Mark all as stopped regardless of whether they were running, to clean up the DB state.
+    # A filter-based set_value issues a single UPDATE for every row.
+    frappe.db.set_value(
+        "MCP Server Process",
+        {"name": ("in", [doc.name for doc in running_docs])},
+        {"status": "Stopped", "stopped_on": frappe.utils.now_datetime()},
+    )
     frappe.db.commit()
 
 
@@ -167,22 +241,25 @@ def check_and_manage_mcp_server():
         return
 
     # 2. If enabled, check for a running process in our logs
-    running_doc = frappe.get_all("MCP Server Process", filters={"status": "Running"}, limit=1)
+    running_doc = frappe.get_all(
+        "MCP Server Process", filters={"status": "Running"}, fields=["name", "pid", "command"], limit=1
+    )
     
     if running_doc:
         doc = running_doc[0]
         pid = doc.get("pid")
         
         # 3. Verify if the logged process is actually still alive
-        if is_process_running(pid):
+        if is_process_running(pid, doc.get("command")):
             # Process is running and healthy. Do nothing.
             print("MCP server process is healthy.")
             return
         else:
             # The process crashed. Log it and prepare to start a new one.
             frappe.log_error(f"MCP Watchdog: Found dead process (PID: {pid}). Marking as Error.", "MCP Task")
-            frappe.db.set_value("MCP Server Process", doc.name, "status", "Error")
-            frappe.db.set_value("MCP Server Process", doc.name, "stopped_on", frappe.utils.now_datetime())
+            frappe.db.set_value(
+                "MCP Server Process", doc.name, {"status": "Error", "stopped_on": frappe.utils.now_datetime()}
+            )
             frappe.db.commit()
 
     # 4. If we reached here, it means no process is running. Start one.
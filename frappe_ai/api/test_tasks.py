@@ -0,0 +1,31 @@
+# Copyright (c) 2025, arvis and Contributors
+# See license.txt
+
+from frappe.tests import UnitTestCase
+
+from frappe_ai.api.tasks import _cmdline_matches
+
+
+class UnitTestMCPServerTasks(UnitTestCase):
+    """Unit tests for recognising the MCP server process behind a stored PID."""
+
+    def test_npm_retitled_argv_matches_npx_command(self):
+        # npm rewrites process.title into one space-separated argv element
+        self.assertTrue(_cmdline_matches([b"npm exec frappe-mcp-server"], "npx frappe-mcp-server"))
+        self.assertTrue(_cmdline_matches([b"npx", b"frappe-mcp-server"], "npx -y frappe-mcp-server"))
+
+    def test_script_path_matches_by_basename(self):
+        self.assertTrue(
+            _cmdline_matches([b"/usr/bin/node", b"/opt/mcp/dist/server.js"], "node dist/server.js")
+        )
+
+    def test_recycled_pid_running_another_program_is_rejected(self):
+        command = "npx frappe-mcp-server"
+        self.assertFalse(_cmdline_matches([b"node", b"/srv/app/worker.js"], command))
+        self.assertFalse(_cmdline_matches([b"/usr/bin/python3", b"-m", b"http.server"], command))
+        self.assertFalse(_cmdline_matches([b"npm exec other-tool"], command))
+
+    def test_command_of_only_generic_programs_matches_any_process(self):
+        # Nothing distinctive to compare against, so any live PID is accepted
+        self.assertTrue(_cmdline_matches([b"/usr/bin/python3", b"-m", b"http.server"], "node"))
+        self.assertTrue(_cmdline_matches([b"bash"], "npx -y"))
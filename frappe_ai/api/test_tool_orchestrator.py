@@ -0,0 +1,170 @@
+# Copyright (c) 2025, arvis and Contributors
+# See license.txt
+
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import frappe
+import requests
+from frappe.tests import UnitTestCase
+
+from frappe_ai.api import tool_orchestrator
+from frappe_ai.utils import OPENROUTER_CHAT_COMPLETIONS_URL, get_openrouter_session
+
+
+def _response(status_code):
+    response = MagicMock(status_code=status_code)
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=response)
+    return response
+
+
+class _Slot:
+    """Stands in for the LLM semaphore and records whether it is held."""
+
+    held = False
+
+    def __enter__(self):
+        self.held = True
+
+    def __exit__(self, *exc_info):
+        self.held = False
+
+
+class UnitTestToolOrchestrator(UnitTestCase):
+    """Unit tests for the tool orchestration helpers."""
+
+    def test_orchestration_model_defaults_per_provider(self):
+        self.assertEqual(
+            tool_orchestrator.resolve_orchestration_model("openrouter"), tool_orchestrator.DEFAULT_OPENROUTER_MODEL
+        )
+        self.assertEqual(tool_orchestrator.resolve_orchestration_model("openai"), "gpt-4.1")
+        self.assertEqual(
+            tool_orchestrator.resolve_orchestration_model("openrouter", "anthropic/claude-sonnet-4"),
+            "anthropic/claude-sonnet-4",
+        )
+
+    def test_orchestration_model_outside_curated_list_is_refused(self):
+        with self.assertRaises(frappe.ValidationError):
+            tool_orchestrator.resolve_orchestration_model("openrouter", "some/expensive-model")
+        with self.assertRaises(frappe.ValidationError):
+            tool_orchestrator.resolve_orchestration_model("openai", "google/gemini-2.5-pro")
+        with self.assertRaises(frappe.ValidationError):
+            tool_orchestrator.resolve_orchestration_model("other")
+
+    def test_execute_tool_calls_keeps_order_and_reports_errors(self):
+        tool_calls = [
+            {"id": "call_a", "function": {"name": "get_doc", "arguments": '{"name": "X"}'}},
+            {"id": "call_b", "function": {"name": "broken", "arguments": "{"}},
+            {"id": "call_c", "function": {"name": "list_docs", "arguments": ""}},
+        ]
+        results = [{"result": {"content": [{"type": "text", "text": "found"}]}}, RuntimeError("down")]
+        log = []
+
+        with (
+            patch.object(tool_orchestrator, "call_mcp_tools", return_value=results) as call_mcp_tools,
+            patch.object(frappe, "log_error"),
+        ):
+            messages = tool_orchestrator.execute_tool_calls(tool_calls, log_container=log)
+
+        # Calls with unparsable arguments never reach the MCP server
+        call_mcp_tools.assert_called_once_with(
+            [("get_doc", {"name": "X"}), ("list_docs", {})], timeout=20, parallel=True
+        )
+        self.assertEqual([m["tool_call_id"] for m in messages], ["call_a", "call_b", "call_c"])
+        self.assertEqual(messages[0]["content"], "found")
+        self.assertIn("Invalid tool arguments", messages[1]["content"])
+        self.assertIn("down", messages[2]["content"])
+        self.assertEqual([step["status"] for step in log], ["success", "error", "error"])
+
+    def test_streamed_tool_call_fragments_are_merged_by_index(self):
+        def data(delta):
+            return b"data: " + json.dumps({"choices": [{"delta": delta}]}).encode()
+
+        lines = [
+            b": OPENROUTER PROCESSING",
+            b"",
+            data({"role": "assistant", "content": "Let me "}),
+            data({"content": "check."}),
+            data({"tool_calls": [{"index": 1, "id": "call_b", "function": {"name": "list_", "arguments": ""}}]}),
+            data({"tool_calls": [{"index": 0, "id": "call_a", "function": {"name": "get_doc", "arguments": '{"na'}}]}),
+            data({"tool_calls": [{"index": 1, "function": {"name": "docs", "arguments": "{}"}}]}),
+            data({"tool_calls": [{"index": 0, "function": {"arguments": 'me": "X"}'}}]}),
+            b"data: [DONE]",
+            data({"content": " ignored"}),
+        ]
+        tokens = []
+
+        message = tool_orchestrator._assemble_streamed_message(
+            SimpleNamespace(iter_lines=lambda: iter(lines)), on_token=tokens.append
+        )
+
+        self.assertEqual(tokens, ["Let me ", "check."])
+        self.assertEqual(message["content"], "Let me check.")
+        self.assertEqual(
+            message["tool_calls"],
+            [
+                {"id": "call_a", "type": "function", "function": {"name": "get_doc", "arguments": '{"name": "X"}'}},
+                {"id": "call_b", "type": "function", "function": {"name": "list_docs", "arguments": "{}"}},
+            ],
+        )
+
+    def _post_with_retries(self, responses, max_retries=3):
+        """
+        Runs `_post_with_retries` against `responses` (exceptions among them are
+        raised by post) and returns (result or raised exception, session, sleeps).
+        """
+        session = MagicMock()
+        session.post.side_effect = responses
+        slot = _Slot()
+        sleeps = []
+
+        def sleep(seconds):
+            # Backing off must not hold a concurrency slot
+            self.assertFalse(slot.held)
+            sleeps.append(seconds)
+
+        def read(response):
+            self.assertTrue(slot.held)
+            return response
+
+        with (
+            patch.object(tool_orchestrator, "get_openrouter_session", return_value=session),
+            patch.object(tool_orchestrator, "_get_llm_semaphore", return_value=slot),
+            patch.object(tool_orchestrator.time, "sleep", side_effect=sleep),
+        ):
+            try:
+                outcome = tool_orchestrator._post_with_retries({}, b"{}", False, 180.0, max_retries, read)
+            except requests.exceptions.RequestException as e:
+                outcome = e
+        return outcome, session, sleeps
+
+    def test_post_retries_connection_errors_and_retryable_statuses(self):
+        rate_limited, ok = _response(429), _response(200)
+        outcome, session, sleeps = self._post_with_retries([requests.exceptions.ConnectionError(), rate_limited, ok])
+
+        self.assertIs(outcome, ok)
+        self.assertEqual(session.post.call_count, 3)
+        self.assertEqual(len(sleeps), 2)
+        rate_limited.close.assert_called_once()
+
+    def test_post_gives_up_after_max_retries(self):
+        outcome, session, _ = self._post_with_retries([requests.exceptions.Timeout()] * 3, max_retries=2)
+        self.assertIsInstance(outcome, requests.exceptions.Timeout)
+        self.assertEqual(session.post.call_count, 3)
+
+        outcome, session, _ = self._post_with_retries([_response(503), _response(503)], max_retries=1)
+        self.assertIsInstance(outcome, requests.exceptions.HTTPError)
+        self.assertEqual(session.post.call_count, 2)
+
+    def test_post_does_not_retry_client_errors(self):
+        outcome, session, sleeps = self._post_with_retries([_response(400), _response(200)])
+        self.assertIsInstance(outcome, requests.exceptions.HTTPError)
+        self.assertEqual(session.post.call_count, 1)
+        self.assertEqual(sleeps, [])
+
+    def test_chat_completions_are_only_retried_by_the_outer_loop(self):
+        session = get_openrouter_session()
+        self.assertEqual(session.get_adapter(OPENROUTER_CHAT_COMPLETIONS_URL).max_retries.total, 0)
+        self.assertEqual(session.get_adapter("https://openrouter.ai/api/v1/keys").max_retries.total, 3)
@@ -2,12 +2,162 @@ import frappe
 import requests
 import json
 import os
+import random
+import threading
+import time
+import httpx
 import openai
-from frappe_ai.api.mcp_client import list_mcp_tools, call_mcp_tool
+from functools import lru_cache
+from importlib.util import find_spec
+from frappe.utils.password import decrypt
+from frappe_ai.api import json_utils
+from frappe_ai.api.models import CURATED_MODELS
+from frappe_ai.api.mcp_client import list_mcp_tools, call_mcp_tool, call_mcp_tools, get_cached_mcp_tools
+from frappe_ai.utils import OPENROUTER_CHAT_COMPLETIONS_URL, get_openrouter_session
+
+# Default model for the native tool-calling (OpenRouter) orchestration path.
+DEFAULT_OPENROUTER_MODEL = "google/gemini-2.5-flash"
+DEFAULT_OPENAI_MODEL = "gpt-4.1"
+
+# Models orchestration may run on the site's keys, per provider: the curated
+# list for OpenRouter, and its OpenAI entries (without prefix) for OpenAI.
+ALLOWED_MODELS = {
+    "openrouter": frozenset(model["id"] for model in CURATED_MODELS),
+    "openai": frozenset(
+        model["id"].removeprefix("openai/") for model in CURATED_MODELS if model["id"].startswith("openai/")
+    ),
+}
+DEFAULT_MODELS = {"openrouter": DEFAULT_OPENROUTER_MODEL, "openai": DEFAULT_OPENAI_MODEL}
+
+# Safety net against the model calling tools forever.
+MAX_TOOL_TURNS = 10
+
+# OpenRouter responses worth re-issuing: the chat completion itself has no side
+# effects (tools run locally), so a stuck or rate-limited call is simply retried.
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+# Streamed answer text is pushed to the desk once this many characters are
+# buffered or this many seconds passed since the last push, not per token.
+TOKEN_PUBLISH_MIN_CHARS = 64
+TOKEN_PUBLISH_INTERVAL = 0.25
+
+# OpenRouter read timeouts: between chunks of a streamed completion, and for
+# a whole non-streamed one, which sends nothing until the model is done.
+STREAM_READ_TIMEOUT = 30.0
+COMPLETION_READ_TIMEOUT = 180.0
+
+# Models that honour explicit `cache_control` breakpoints through OpenRouter.
+# OpenAI models cache long prompt prefixes automatically.
+PROMPT_CACHE_MODEL_PREFIXES = ("anthropic/", "google/")
+
+# httpx only speaks HTTP/2 with the optional `h2` package installed.
+HTTP2_AVAILABLE = find_spec("h2") is not None
+
+# Per-process cap on in-flight LLM calls (`llm_max_concurrency` in site config)
+DEFAULT_LLM_MAX_CONCURRENCY = 10
+
+# Static part of the hosted MCP tool definition for the Responses API;
+# only the server URL varies.
+MCP_TOOL_BASE = {
+    "type": "mcp",
+    "server_label": "sentrafrappe",
+    "require_approval": "never",
+}
+
+# Built Responses tools payloads keyed by MCP server URL. The URL only
+# changes when AI Setting is saved, which clears this.
+_TOOLS_PAYLOAD_CACHE: dict[str, list] = {}
+
+TOOL_USE_INSTRUCTIONS = """ 
+**Key Instructions:**
+- **Follow Tool Schemas**: When calling a tool, you **must** use the exact parameter names defined in its function signature. Refer to the tool's definition to understand the required arguments and their format. Do not guess parameter names.
+- **CRITICAL - Parameter Names**: For `create_document` and `update_document`, the parameter for the document's data is called `values`. The parameter `fields` is used for reading tools like `get_document`. **DO NOT** use `fields` when you mean to use `values`.
+- **Pay Attention to Nested Objects**: Carefully examine every tool's schema for parameters that are of type 'object'. You **must** construct a nested JSON object for these parameters as specified in their schema. Do not flatten the structure. For example: `create_document(doctype='Contact', values={'first_name': 'John'})`.
+- **Never Ask for Information**: You have tools to find information. Use them. Do not ask the user for names, IDs, or other details you can discover yourself.
+- **Self-Correct on Errors**: If a tool returns an error, do not give up. This often means your initial assumption was wrong. Look at the error and try again to solve it with the tools that are available to you.
+- **Do not ask for permission**: Do not ask the user for permission to use a tool. Recursively use the tools to find the answer and complete the task.
+You can call multiple tools in the same run. Do not stop until the task is done. Keep iterating on what to do next given the situation and recursively call tools to solve tasks.
+        """
+
+@lru_cache(maxsize=1)
+def _get_llm_semaphore() -> threading.BoundedSemaphore:
+    """
+    Bounds the LLM calls a worker process has in flight, so bursts of
+    concurrent orchestrations queue locally instead of tripping provider
+    rate limits and paying for full retries.
+    """
+    limit = int(frappe.conf.get("llm_max_concurrency") or DEFAULT_LLM_MAX_CONCURRENCY)
+    return threading.BoundedSemaphore(limit)
+
+@lru_cache(maxsize=4)
+def _get_openai_client(api_key: str) -> openai.OpenAI:
+    """
+    Returns a long-lived OpenAI client per API key. Constructing a client
+    builds a new httpx connection pool, so it is done once per worker instead
+    of on every Responses call.
+    """
+    http_client = httpx.Client(
+        # Concurrent Responses calls share one multiplexed connection when h2 is installed
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=30.0),
+        timeout=httpx.Timeout(180.0, connect=10.0),
+    )
+    return openai.OpenAI(api_key=api_key, http_client=http_client)
 
 def get_ai_settings():
-    """Retrieves the AI Settings document once."""
-    return frappe.get_single("AI Setting")
+    """
+    Retrieves the AI Settings document from the document cache. Frappe clears
+    the cached copy whenever the settings are saved. Treat it as read-only.
+    """
+    return frappe.get_cached_doc("AI Setting")
+
+# Password fields of AI Setting, stored encrypted in the __Auth table.
+_CREDENTIAL_FIELDS = ("site_api_key", "openai_api_key")
+
+def _load_credentials() -> dict:
+    """
+    Decrypts every AI Setting API key with a single __Auth query instead of
+    one `get_password` round-trip per field. Returns {fieldname: key}.
+    The result is kept on frappe.local for the rest of the request or job.
+    """
+    credentials = getattr(frappe.local, "ai_credentials", None)
+    if credentials is not None:
+        return credentials
+
+    Auth = frappe.qb.Table("__Auth")
+    rows = (
+        frappe.qb.from_(Auth)
+        .select(Auth.fieldname, Auth.password)
+        .where(
+            (Auth.doctype == "AI Setting")
+            & (Auth.name == "AI Setting")
+            & (Auth.fieldname.isin(_CREDENTIAL_FIELDS))
+            & (Auth.encrypted == 1)
+        )
+        .run(as_dict=True)
+    )
+    credentials = {row.fieldname: decrypt(row.password) for row in rows}
+    frappe.local.ai_credentials = credentials
+    return credentials
+
+@lru_cache(maxsize=8)
+def _get_site_api_key(site: str, key_hash: str) -> str:
+    """
+    Decrypts the provisioned OpenRouter key once per site and key.
+    Keying on `key_hash` means a re-provisioned key is never served stale.
+    """
+    return _load_credentials().get("site_api_key")
+
+def clear_api_key_cache():
+    """Drops memoized API keys. Called when AI Setting is updated."""
+    _get_site_api_key.cache_clear()
+    # Keys decrypted earlier in this same request must not outlive the save.
+    if hasattr(frappe.local, "ai_credentials"):
+        del frappe.local.ai_credentials
+
+def clear_tools_payload_cache():
+    """Drops cached Responses tools payloads. Called when AI Setting is updated."""
+    _TOOLS_PAYLOAD_CACHE.clear()
 
 def get_openrouter_api_key(settings=None):
     """Retrieves the provisioned OpenRouter API key from AI Settings."""
@@ -15,14 +165,12 @@ def get_openrouter_api_key(settings=None):
         settings = get_ai_settings()
     if not settings.key_provisioned:
         raise frappe.PermissionError("OpenRouter API key has not been provisioned for this site.")
-    return settings.get_password("site_api_key")
+    return _get_site_api_key(frappe.local.site, settings.key_hash)
 
 def get_openai_api_key(settings=None):
     """Retrieves the OpenAI API key from AI Settings."""
-    if settings is None:
-        settings = get_ai_settings()
     # This assumes a field 'openai_api_key' of type 'Password' exists in 'AI Setting' DocType.
-    openai_key = settings.get_password("openai_api_key")
+    openai_key = _load_credentials().get("openai_api_key")
     if not openai_key:
         raise frappe.PermissionError("OpenAI API key is not set in AI Settings.")
     return openai_key
@@ -30,18 +178,31 @@ def get_openai_api_key(settings=None):
 def get_mcp_server_url(settings=None):
     """Retrieves the MCP server URL from AI Settings."""
     if settings is None:
-        settings = get_ai_settings()
-    mcp_url = settings.get("mcp_server_url")
+        mcp_url = frappe.db.get_single_value("AI Setting", "mcp_server_url", cache=True)
+    else:
+        mcp_url = settings.get("mcp_server_url")
     if not mcp_url:
         raise frappe.ValidationError("MCP Server URL is not set in AI Settings.")
     return mcp_url
 
-def openrouter_call(model_id: str, messages: list, tools: list = None, tool_choice: str = "auto", temperature: float = 0.2, settings=None):
+def openrouter_call(model_id: str, messages: list, tools: list = None, tool_choice: str = "auto", temperature: float = 0.2, settings=None, stream: bool = False, on_token=None, api_key: str = None, parallel_tool_calls: bool = True, request_timeout: float = None, max_retries: int = 3):
     """
     Makes a call to the OpenRouter LLM API, supporting tool use.
     Returns the entire assistant message object from the response.
+    With `stream=True` the response is read as server-sent events and the
+    message is assembled incrementally; `on_token` receives each content delta.
+    Multi-turn callers can pass `api_key` to skip the per-call key lookup.
+    `parallel_tool_calls` lets the model request several tools in one turn.
+    `request_timeout` is the read timeout: between chunks when streaming
+    (default 30s), for the whole completion otherwise (default 180s, since a
+    non-streamed reasoning model sends nothing until it is done). Timed-out or
+    retryable responses are re-issued up to `max_retries` times with
+    exponential backoff, but never once streaming has started.
     """
-    api_key = get_openrouter_api_key(settings)
+    if request_timeout is None:
+        request_timeout = STREAM_READ_TIMEOUT if stream else COMPLETION_READ_TIMEOUT
+    if api_key is None:
+        api_key = get_openrouter_api_key(settings)
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -54,51 +215,127 @@ def openrouter_call(model_id: str, messages: list, tools: list = None, tool_choi
     if tools:
         body["tools"] = tools
         body["tool_choice"] = tool_choice
+        body["parallel_tool_calls"] = parallel_tool_calls
+    if stream:
+        body["stream"] = True
     
+    def read_message(response):
+        if stream:
+            return _assemble_streamed_message(response, on_token)
+        return json_utils.loads(response.content)["choices"][0]["message"]
+
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=body,
-            timeout=180 # Increased timeout for potentially long tool-use chains
-        )
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]
+        return _post_with_retries(headers, json_utils.dumps(body), stream, request_timeout, max_retries, read_message)
     except requests.exceptions.RequestException as e:
         frappe.log_error(f"LLM call failed: {e.response.text if e.response else e}", "LLM Call Error")
         raise
 
-def openai_responses_call(model_id: str, messages: list, log_container: list = None, settings=None):
+def _post_with_retries(headers: dict, data: bytes, stream: bool, request_timeout: float, max_retries: int, read):
+    """
+    Posts a chat completion and returns `read(response)`, retrying timeouts and
+    retryable status codes. The LLM semaphore is held for each attempt,
+    reading included, but not while backing off between attempts.
+    """
+    for attempt in range(max_retries + 1):
+        is_last_attempt = attempt == max_retries
+        with _get_llm_semaphore():
+            try:
+                response = get_openrouter_session().post(
+                    OPENROUTER_CHAT_COMPLETIONS_URL,
+                    headers=headers,
+                    data=data,
+                    stream=stream,
+                    timeout=(5, request_timeout)
+                )
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                if is_last_attempt:
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or is_last_attempt:
+                    with response:
+                        response.raise_for_status()
+                        return read(response)
+                response.close()
+
+        # Jitter keeps workers that hit a 429 together from retrying in lockstep
+        time.sleep(1.5 * 2 ** attempt + random.uniform(0, 1))
+
+def _iter_sse_events(response):
+    """Yields the decoded JSON payload of each `data:` frame of an SSE response."""
+    for line in response.iter_lines():
+        # Skip keep-alive blank lines and ": OPENROUTER PROCESSING" comments
+        if not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            break
+        yield json_utils.loads(data)
+
+def _assemble_streamed_message(response, on_token=None) -> dict:
+    """
+    Rebuilds a chat completion message from streamed deltas. Content is
+    concatenated and `tool_calls` fragments are merged by their index.
+    """
+    content_parts = []
+    tool_calls = {}
+
+    for chunk in _iter_sse_events(response):
+        if chunk.get("error"):
+            raise requests.exceptions.RequestException(f"Stream error: {chunk['error']}")
+        choices = chunk.get("choices")
+        if not choices:
+            continue
+        delta = choices[0].get("delta") or {}
+
+        token = delta.get("content")
+        if token:
+            content_parts.append(token)
+            if on_token:
+                on_token(token)
+
+        for fragment in delta.get("tool_calls") or []:
+            tool_call = tool_calls.setdefault(fragment.get("index", 0), {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""},
+            })
+            if fragment.get("id"):
+                tool_call["id"] = fragment["id"]
+            function = fragment.get("function") or {}
+            tool_call["function"]["name"] += function.get("name") or ""
+            tool_call["function"]["arguments"] += function.get("arguments") or ""
+
+    message = {"role": "assistant", "content": "".join(content_parts)}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    return message
+
+def openai_responses_call(model_id: str, messages: list, log_container: list = None, settings=None, request_timeout: float = 180.0, max_retries: int = 2, previous_response_id: str = None, on_output_item=None, truncation: str = None):
     """
     Makes a call to the OpenAI Responses API, supporting tool use and conversation state.
     Returns the entire response object.
+    The timeout is generous because hosted MCP tool chains run inside this one
+    call; the SDK retries connection errors, 408/429 and 5xx with backoff.
+    When continuing a conversation, pass `previous_response_id` and only the
+    new input items: OpenAI keeps the earlier turns server-side.
+    With `on_output_item`, the response is streamed and the callback receives
+    each output item (tool listing, tool call, message) as soon as it is done.
+    `truncation="auto"` lets OpenAI drop the oldest turns of a long chain
+    instead of failing once it outgrows the context window.
     """
     if settings is None:
         settings = get_ai_settings()
     
-    client = openai.OpenAI(api_key=get_openai_api_key(settings))
+    client = _get_openai_client(get_openai_api_key(settings))
     mcp_server_url = get_mcp_server_url(settings)
     
-    tools_payload = [
-            {
-                "type": "mcp",
-                "server_label": "sentrafrappe",
-                "server_url": mcp_server_url,
-                "require_approval": "never",
-            },
-        ]
+    tools_payload = _TOOLS_PAYLOAD_CACHE.get(mcp_server_url)
+    if tools_payload is None:
+        tools_payload = _TOOLS_PAYLOAD_CACHE.setdefault(
+            mcp_server_url, [{**MCP_TOOL_BASE, "server_url": mcp_server_url}]
+        )
     # The 'input' parameter expects the full message structure, not just the content string.
     input_payload = messages 
-    instructions_payload = """ 
-**Key Instructions:**
-- **Follow Tool Schemas**: When calling a tool, you **must** use the exact parameter names defined in its function signature. Refer to the tool's definition to understand the required arguments and their format. Do not guess parameter names.
-- **CRITICAL - Parameter Names**: For `create_document` and `update_document`, the parameter for the document's data is called `values`. The parameter `fields` is used for reading tools like `get_document`. **DO NOT** use `fields` when you mean to use `values`.
-- **Pay Attention to Nested Objects**: Carefully examine every tool's schema for parameters that are of type 'object'. You **must** construct a nested JSON object for these parameters as specified in their schema. Do not flatten the structure. For example: `create_document(doctype='Contact', values={'first_name': 'John'})`.
-- **Never Ask for Information**: You have tools to find information. Use them. Do not ask the user for names, IDs, or other details you can discover yourself.
-- **Self-Correct on Errors**: If a tool returns an error, do not give up. This often means your initial assumption was wrong. Look at the error and try again to solve it with the tools that are available to you.
-- **Do not ask for permission**: Do not ask the user for permission to use a tool. Recursively use the tools to find the answer and complete the task.
-You can call multiple tools in the same run. Do not stop until the task is done. Keep iterating on what to do next given the situation and recursively call tools to solve tasks.
-        """
 
     if log_container is not None:
         log_container.append({
@@ -110,114 +347,400 @@ You can call multiple tools in the same run. Do not stop until the task is done.
             }
         })
 
-    response = client.responses.create(
-        model=model_id,
-        tools=tools_payload,
-        input=input_payload,
-        instructions=instructions_payload
-    )
-    return response
+    optional_params = {}
+    if previous_response_id:
+        optional_params["previous_response_id"] = previous_response_id
+    if truncation:
+        optional_params["truncation"] = truncation
+
+    client = client.with_options(timeout=request_timeout, max_retries=max_retries)
+    with _get_llm_semaphore():
+        if on_output_item is None:
+            return client.responses.create(
+                model=model_id,
+                tools=tools_payload,
+                input=input_payload,
+                instructions=TOOL_USE_INSTRUCTIONS,
+                **optional_params
+            )
 
-def llm_call(provider: str, model_id: str, messages: list, tools: list = None, tool_choice: str = "auto", temperature: float = 0.2, previous_response_id: str = None):
+        with client.responses.stream(
+            model=model_id,
+            tools=tools_payload,
+            input=input_payload,
+            instructions=TOOL_USE_INSTRUCTIONS,
+            **optional_params
+        ) as stream:
+            for event in stream:
+                if event.type == "response.output_item.done":
+                    on_output_item(event.item)
+            return stream.get_final_response()
+
+def llm_call(provider: str, model_id: str, messages: list, tools: list = None, tool_choice: str = "auto", temperature: float = 0.2, previous_response_id: str = None, enable_parallel_tool_execution: bool = True):
     # Get settings once and pass to the appropriate function
     settings = get_ai_settings()
     
     if provider == "openrouter":
-        return openrouter_call(model_id, messages, tools, tool_choice, temperature, settings)
+        return openrouter_call(
+            model_id, messages, tools, tool_choice, temperature, settings,
+            parallel_tool_calls=enable_parallel_tool_execution
+        )
     else: # Default to openai
-        return openai_responses_call(model_id, messages, settings=settings)
+        return openai_responses_call(model_id, messages, settings=settings, previous_response_id=previous_response_id)
+
+def execute_tool_calls(tool_calls: list, timeout: int = 20, log_container: list = None, parallel: bool = True) -> list:
+    """
+    Executes the `tool_calls` of an assistant message against the MCP server.
+    Independent calls are dispatched concurrently unless `parallel` is False;
+    the returned "tool" role messages keep the original order so they can be
+    appended to the conversation.
+    """
+    tool_messages = [None] * len(tool_calls)
+    errors = [None] * len(tool_calls)
+    pending = []
+
+    for index, tool_call in enumerate(tool_calls):
+        function = tool_call.get("function", {})
+        try:
+            arguments = json_utils.loads(function.get("arguments") or "{}")
+        except ValueError as e:
+            errors[index] = f"Invalid tool arguments: {e}"
+            tool_messages[index] = _tool_message(tool_call, {"error": errors[index]})
+            continue
+        pending.append((index, function.get("name"), arguments))
+
+    results = call_mcp_tools(
+        [(name, arguments) for _, name, arguments in pending], timeout=timeout, parallel=parallel
+    )
+
+    for (index, tool_name, _), result in zip(pending, results):
+        if isinstance(result, Exception):
+            frappe.log_error(f"MCP tool '{tool_name}' failed: {result}", "Tool Orchestration")
+            errors[index] = str(result)
+            content = {"error": errors[index]}
+        else:
+            content = _tool_result_content(result)
+        tool_messages[index] = _tool_message(tool_calls[index], content)
+
+    if log_container is not None:
+        for tool_call, tool_message, error in zip(tool_calls, tool_messages, errors):
+            tool_name = tool_call.get("function", {}).get("name", "unknown_tool")
+            data = {"tool_name": tool_name, "output_size": len(tool_message["content"])}
+            if error:
+                data["error"] = error
+            log_container.append({
+                "step": f"Execute Tool: {tool_name}",
+                "status": "error" if error else "success",
+                "data": data
+            })
+
+    return tool_messages
+
+def _tool_result_content(response_json: dict):
+    """
+    Extracts what the model should see from a tools/call response. MCP tools
+    return their payload as text parts (usually already JSON), which is passed
+    through as-is instead of being JSON-encoded a second time.
+    """
+    result = response_json.get("result")
+    if result is None:
+        return response_json.get("error", {})
+
+    parts = result.get("content") if isinstance(result, dict) else None
+    if parts and all(part.get("type") == "text" for part in parts):
+        return "\n".join(part.get("text", "") for part in parts)
+    return result
+
+def _tool_message(tool_call: dict, content) -> dict:
+    """Builds an OpenAI-format tool result message."""
+    if not isinstance(content, str):
+        content = json_utils.dumps(content).decode("utf-8")
+    return {
+        "role": "tool",
+        "tool_call_id": tool_call.get("id"),
+        "content": content,
+    }
 
 def format_openai_output_to_log(response_obj):
     """Formats the OpenAI response object into a structured log for the frontend."""
     log = []
-    final_response_text = ""
+    # Collected and joined once; repeated str += is quadratic on long outputs
+    final_response_chunks = []
     
     if not hasattr(response_obj, 'output') or not response_obj.output:
-        return log, final_response_text
+        return log, ""
 
     for item in response_obj.output:
-        item_dict = item.model_dump(exclude_unset=True)
-        step_name = item_dict.get('type', 'Unknown Step').replace('_', ' ').title()
-        status = 'success'
-        data = {}
-
-        if item_dict.get('error'):
-            status = 'error'
-            data['error'] = item_dict['error']
-        
-        if item_dict.get('type') == 'mcp_list_tools':
-            step_name = f"List Tools ({item_dict.get('server_label', '')})"
-            tools_list = item_dict.get('tools', [])
-            data['tools_found'] = len(tools_list)
-            # Log only tool names, not full schemas
-            data['tool_names'] = [tool.get('name', 'unknown') for tool in tools_list] if tools_list else []
-
-        elif item_dict.get('type') == 'mcp_call':
-            tool_name = item_dict.get('name', 'unknown_tool')
-            step_name = f"Execute Tool: {tool_name}"
-            data['tool_name'] = tool_name
-            # Log summary instead of full arguments and output
-            if item_dict.get('arguments'):
-                data['arguments_provided'] = True
-                data['arg_count'] = len(item_dict.get('arguments', {}))
-            if item_dict.get('output'):
-                output = item_dict.get('output')
-                data['output_received'] = True
-                # Summarize output instead of logging everything
-                if isinstance(output, str):
-                    data['output_size'] = len(output)
-                elif isinstance(output, (list, dict)):
-                    data['output_type'] = type(output).__name__
-                    data['output_size'] = len(str(output)) if output else 0
-
-        elif item_dict.get('type') == 'message':
-            step_name = "Assistant Message"
-            if item_dict.get('role') == 'assistant' and item_dict.get('content'):
-                text_content = ""
-                for content_part in item_dict['content']:
-                    if content_part.get('type') == 'output_text':
-                        text_content += content_part.get('text', '')
-                # Don't add empty messages to the final response
-                if text_content.strip():
-                    final_response_text += text_content + "\\n\\n"
-                # Skip adding empty assistant messages to the log
-                if not text_content.strip():
-                    continue
-                # Log message length instead of full content for brevity
-                data['message_length'] = len(text_content)
-                data['has_content'] = True
-                # Only log first 100 chars for debugging if needed
-                data['preview'] = text_content[:100] + "..." if len(text_content) > 100 else text_content
-            else:
-                # Don't log non-assistant messages
-                continue
-        
-        log.append({"step": step_name, "status": status, "data": data})
+        step, text_content = format_output_item(item)
+        # Don't add empty messages to the final response
+        if text_content:
+            final_response_chunks.append(text_content)
+        if step:
+            log.append(step)
+
+    return log, "\\n\\n".join(final_response_chunks).strip()
+
+def _format_list_tools(item, data):
+    tools_list = getattr(item, 'tools', None) or []
+    data['tools_found'] = len(tools_list)
+    # Log only tool names, not full schemas
+    data['tool_names'] = [getattr(tool, 'name', 'unknown') for tool in tools_list]
+    return f"List Tools ({getattr(item, 'server_label', '') or ''})", None
+
+def _format_mcp_call(item, data):
+    tool_name = getattr(item, 'name', None) or 'unknown_tool'
+    data['tool_name'] = tool_name
+    # Log summary instead of full arguments and output
+    arguments = getattr(item, 'arguments', None)
+    if arguments:
+        data['arguments_provided'] = True
+        data['arg_count'] = len(arguments)
+    output = getattr(item, 'output', None)
+    if output:
+        data['output_received'] = True
+        # Summarize output instead of logging everything
+        if isinstance(output, str):
+            data['output_size'] = len(output)
+        elif isinstance(output, (list, dict)):
+            data['output_type'] = type(output).__name__
+            # Item count rather than len(str(output)), which would
+            # re-serialize the whole tool output just to measure it
+            data['output_items'] = len(output)
+    return f"Execute Tool: {tool_name}", None
+
+def _format_message(item, data):
+    content = getattr(item, 'content', None)
+    if getattr(item, 'role', None) != 'assistant' or not content:
+        # Don't log non-assistant messages
+        return None
+    text_content = ''.join(
+        content_part.text or ''
+        for content_part in content
+        if getattr(content_part, 'type', None) == 'output_text'
+    )
+    # Skip adding empty assistant messages to the log
+    if not text_content.strip():
+        return None
+    # Log message length instead of full content for brevity
+    data['message_length'] = len(text_content)
+    data['has_content'] = True
+    # Only log first 100 chars for debugging if needed
+    data['preview'] = text_content[:100] + "..." if len(text_content) > 100 else text_content
+    return "Assistant Message", text_content
+
+# Per-type formatters: each fills `data` and returns (step_name, text), or
+# None when the item should not be logged at all.
+_OUTPUT_ITEM_FORMATTERS = {
+    'mcp_list_tools': _format_list_tools,
+    'mcp_call': _format_mcp_call,
+    'message': _format_message,
+}
+
+def format_output_item(item):
+    """
+    Formats a single Responses output item. Returns (log_step, text), where
+    log_step is None for items that are not logged and text is the assistant
+    text carried by a message item.
+    """
+    # Read only the fields we need straight off the pydantic model instead
+    # of materializing every item with model_dump().
+    item_type = getattr(item, 'type', None)
+    step_name = (item_type or 'Unknown Step').replace('_', ' ').title()
+    status = 'success'
+    data = {}
+    text_content = None
+
+    error = getattr(item, 'error', None)
+    if error:
+        status = 'error'
+        data['error'] = error.model_dump(exclude_unset=True) if hasattr(error, 'model_dump') else error
+
+    formatter = _OUTPUT_ITEM_FORMATTERS.get(item_type)
+    if formatter is not None:
+        formatted = formatter(item, data)
+        if formatted is None:
+            return None, None
+        step_name, text_content = formatted
+
+    return {"step": step_name, "status": status, "data": data}, text_content
+
+def _publish_output_item(item):
+    """Pushes the log step for a finished Responses output item to the user."""
+    step, _ = format_output_item(item)
+    if step:
+        frappe.publish_realtime("ai_orchestration_progress", step, user=frappe.session.user)
+
+class _TokenPublisher:
+    """
+    Pushes the streamed text of one tool-loop turn to the requesting user's
+    desk session, batched into `ai_orchestration_token` events. Each event
+    carries the turn index; the turn's last one has `done` set, and `final`
+    tells whether the text is the answer or a preamble to tool calls.
+    """
 
-    return log, final_response_text.strip()
+    def __init__(self, turn: int):
+        self.turn = turn
+        self.buffer = []
+        self.buffered_chars = 0
+        self.last_publish = time.monotonic()
+
+    def __call__(self, token: str):
+        self.buffer.append(token)
+        self.buffered_chars += len(token)
+        if (
+            self.buffered_chars >= TOKEN_PUBLISH_MIN_CHARS
+            or time.monotonic() - self.last_publish >= TOKEN_PUBLISH_INTERVAL
+        ):
+            self._publish()
+
+    def finish(self, final: bool):
+        self._publish(done=True, final=final)
+
+    def _publish(self, **flags):
+        frappe.publish_realtime(
+            "ai_orchestration_token",
+            {"turn": self.turn, "token": "".join(self.buffer), **flags},
+            user=frappe.session.user,
+        )
+        self.buffer.clear()
+        self.buffered_chars = 0
+        self.last_publish = time.monotonic()
+
+def get_openrouter_tools() -> list:
+    """
+    Fetches the MCP tool catalog and converts it to the OpenAI function-calling
+    format, so the model can request tools natively via `tool_calls`.
+    """
+    tools = get_cached_mcp_tools().get("tools", [])
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": tool["name"],
+                "description": tool.get("description", ""),
+                "parameters": tool.get("inputSchema") or {"type": "object", "properties": {}},
+            },
+        }
+        for tool in tools
+    ]
+
+def _tool_use_system_message(model_id: str) -> dict:
+    """
+    Builds the system message for the tool loop. For models that support it,
+    the message carries a cache breakpoint: the provider caches the prefix up to
+    it (tool schemas + instructions), so later turns don't re-process it.
+    """
+    if model_id.startswith(PROMPT_CACHE_MODEL_PREFIXES):
+        return {
+            "role": "system",
+            "content": [{"type": "text", "text": TOOL_USE_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}}],
+        }
+    return {"role": "system", "content": TOOL_USE_INSTRUCTIONS}
+
+def run_openrouter_tool_loop(model_id: str, messages: list, log_container: list, settings=None, enable_parallel_tool_execution: bool = True) -> str:
+    """
+    Runs the native tool-calling loop against OpenRouter: the model emits
+    `tool_calls`, we execute them on the MCP server and feed the results back,
+    until it answers without requesting tools. Returns the final answer text.
+    With parallel execution enabled, all tool calls of a turn run concurrently.
+    """
+    formatted_tools = get_openrouter_tools()
+    log_container.append({
+        "step": "List Tools (MCP)",
+        "status": "success",
+        "data": {
+            "tools_found": len(formatted_tools),
+            "tool_names": [tool["function"]["name"] for tool in formatted_tools]
+        }
+    })
+
+    messages = [_tool_use_system_message(model_id)] + messages
+    api_key = get_openrouter_api_key(settings)
+
+    for turn in range(MAX_TOOL_TURNS):
+        log_container.append({
+            "step": f"LLM Call (Turn {turn + 1})",
+            "status": "info",
+            "data": {"model": model_id, "message_count": len(messages)}
+        })
+        publish_tokens = _TokenPublisher(turn)
+        assistant_message = openrouter_call(
+            model_id,
+            messages,
+            tools=formatted_tools,
+            stream=True,
+            on_token=publish_tokens,
+            api_key=api_key,
+            parallel_tool_calls=enable_parallel_tool_execution,
+        )
+        messages.append(assistant_message)
+
+        tool_calls = assistant_message.get("tool_calls")
+        publish_tokens.finish(final=not tool_calls)
+        if not tool_calls:
+            return assistant_message.get("content") or ""
+
+        messages.extend(
+            execute_tool_calls(tool_calls, log_container=log_container, parallel=enable_parallel_tool_execution)
+        )
+
+    log_container.append({
+        "step": "Tool Turn Limit Reached",
+        "status": "error",
+        "data": {"error": f"Stopped after {MAX_TOOL_TURNS} tool-use turns."}
+    })
+    return ""
+
+def resolve_orchestration_model(provider: str, model_id: str = None) -> str:
+    """
+    Returns the model to orchestrate with, defaulting per provider. Anything
+    outside the curated list is refused so callers can't run arbitrary models
+    on the site's API keys.
+    """
+    if provider not in ALLOWED_MODELS:
+        frappe.throw(frappe._("Unsupported provider: {0}").format(provider))
+    model_id = model_id or DEFAULT_MODELS[provider]
+    if model_id not in ALLOWED_MODELS[provider]:
+        frappe.throw(frappe._("Model {0} is not available for {1}").format(model_id, provider))
+    return model_id
 
 @frappe.whitelist()
-def run_tool_orchestration(user_query: str):
+def run_tool_orchestration(user_query: str, provider: str = "openai", model_id: str = None):
     """
     Runs a multi-step tool-use loop, allowing the LLM to recursively use tools
     from the MCP server to answer a user's query.
     """
+    model_id = resolve_orchestration_model(provider, model_id)
     try:
         # Get settings once for the entire orchestration
         settings = get_ai_settings()
         
         messages = [{"role": "user", "content": user_query}]
         initial_log = []
-        response_obj = openai_responses_call("gpt-4.1", messages, log_container=initial_log, settings=settings)
-        
-        parsed_log, final_response = format_openai_output_to_log(response_obj)
+        if provider == "openrouter":
+            final_response = run_openrouter_tool_loop(
+                model_id, messages, log_container=initial_log, settings=settings
+            )
+            parsed_log = []
+        else:
+            response_obj = openai_responses_call(
+                model_id, messages, log_container=initial_log, settings=settings,
+                on_output_item=_publish_output_item
+            )
+            parsed_log, final_response = format_openai_output_to_log(response_obj)
 
         log = initial_log + parsed_log
         
-        has_error = any(step['status'] == 'error' for step in log)
+        # Count errors and tool calls in a single pass over the log
+        has_error = False
+        tool_calls = 0
+        for step in log:
+            if step['status'] == 'error':
+                has_error = True
+            if step['step'].startswith('Execute Tool:'):
+                tool_calls += 1
 
         # Add completion summary
-        tool_calls = len([step for step in log if step['step'].startswith('Execute Tool:')])
         log.append({
             "step": "Orchestration Complete",
             "status": "success" if not has_error else "completed_with_errors",
@@ -243,4 +766,26 @@ def run_tool_orchestration(user_query: str):
             }],
             "final_response": f"**Orchestration Failed**\n\nAn unhandled error occurred: {str(e)}",
             "error": True
-        } 
\ No newline at end of file
+        } 
+
+@frappe.whitelist()
+def enqueue_tool_orchestration(user_query: str, provider: str = "openai", model_id: str = None):
+    """
+    Non-blocking variant of `run_tool_orchestration`. The tool-use loop runs in
+    a background job instead of holding a web worker for its full duration;
+    the result is pushed to the user via the "ai_orchestration_result" event.
+    """
+    model_id = resolve_orchestration_model(provider, model_id)
+    job = frappe.enqueue(
+        "frappe_ai.api.tool_orchestrator.run_tool_orchestration_job",
+        queue="long",
+        user_query=user_query,
+        provider=provider,
+        model_id=model_id,
+    )
+    return {"job_id": job.id if job else None}
+
+def run_tool_orchestration_job(user_query: str, provider: str = "openai", model_id: str = None):
+    """Background job body for `enqueue_tool_orchestration`."""
+    result = run_tool_orchestration(user_query, provider=provider, model_id=model_id)
+    frappe.publish_realtime("ai_orchestration_result", result, user=frappe.session.user)
@@ -61,8 +61,9 @@ def mcp_dev_server(context):
         if process and process.pid:
             running_doc = frappe.db.get_value("MCP Server Process", {"pid": process.pid, "status": "Running"})
             if running_doc:
-                frappe.db.set_value("MCP Server Process", running_doc, "status", "Stopped")
-                frappe.db.set_value("MCP Server Process", running_doc, "stopped_on", frappe.utils.now_datetime())
+                frappe.db.set_value(
+                    "MCP Server Process", running_doc, {"status": "Stopped", "stopped_on": frappe.utils.now_datetime()}
+                )
                 frappe.db.commit()
         
         frappe.destroy()
@@ -6,8 +6,14 @@ from frappe.model.document import Document
 import requests
 from typing import TYPE_CHECKING
 from frappe.types import DF
+from frappe_ai.utils import get_openrouter_session
+
+def _logger():
+	return frappe.logger("frappe_ai.ai_setting", allow_site=True, file_count=5)
+
+# (connect, read) timeout for the OpenRouter key management API
+OPENROUTER_KEYS_TIMEOUT = (5, 30)
 
-	
 
 class AISetting(Document):
 	enable_ai: DF.Check
@@ -29,24 +35,29 @@ class AISetting(Document):
 			
 
 	def on_update(self):
+		from frappe_ai.api.tool_orchestrator import clear_api_key_cache, clear_tools_payload_cache
+
+		clear_api_key_cache()
+		clear_tools_payload_cache()
 		if getattr(self, "_new_key_provisioned", False):
 			frappe.msgprint(frappe._("Successfully provisioned and saved OpenRouter API Key!"), indicator="green", alert=True)
 	
 
 	def _delete_key(self):
-		print("Deleting key")
+		_logger().debug("Deleting OpenRouter key %s", self.key_hash)
 		key_hash = self.key_hash
 		master_key = frappe.conf.get("openrouter_provisioning_key")
 		if not master_key:
 			frappe.throw("OpenRouter Provisioning Key is not set in common_sites_config.json.")
 
 		try:
-			response = requests.delete(
+			response = get_openrouter_session().delete(
 				f"https://openrouter.ai/api/v1/keys/{key_hash}",
 				headers={
 					"Authorization": f"Bearer {master_key}",
 					"Content-Type": "application/json"
-				}
+				},
+				timeout=OPENROUTER_KEYS_TIMEOUT
 			)
 			response.raise_for_status()
 			frappe.msgprint(frappe._("Successfully deleted OpenRouter API Key!"), indicator="green", alert=True)
@@ -66,7 +77,7 @@ class AISetting(Document):
 	
 	
 	def _provision_and_set_key(self):
-		print("Provisioning and setting key")
+		_logger().debug("Provisioning OpenRouter key for %s", frappe.local.site)
 		master_key = frappe.conf.get("openrouter_provisioning_key")
 		if not master_key:
 			frappe.throw("OpenRouter Provisioning Key is not set in common_sites_config.json.")
@@ -74,10 +85,11 @@ class AISetting(Document):
 		key_name = frappe.local.site
 
 		try:
-			response = requests.post(
+			response = get_openrouter_session().post(
 				"https://openrouter.ai/api/v1/keys",
 				headers={"Authorization": f"Bearer {master_key}"},
-				json={"name": key_name}
+				json={"name": key_name},
+				timeout=OPENROUTER_KEYS_TIMEOUT
 			)
 			response.raise_for_status()  # This will raise an error for 4xx/5xx responses
 			key_data = response.json()
@@ -90,12 +102,10 @@ class AISetting(Document):
 			frappe.throw(f"An unexpected error occurred. Please check logs.")
 
 		try:
-			print(f"---OpenRouter Raw Response: {key_data}---")
 			data = key_data.get("data")
 			key=key_data.get("key")
-			print(f"---OpenRouter Key: {key}---")
-			
-			
+			_logger().debug("OpenRouter key metadata: %s", data)
+
 			key_hash = data.get("hash")
 			openrouter_user_id = data.get("name")
 		except (IndexError, TypeError, KeyError, AttributeError) as e:
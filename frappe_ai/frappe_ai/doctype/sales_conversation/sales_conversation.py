@@ -3,169 +3,386 @@
 
 import frappe
 import json
+import openai
 from frappe.model.document import Document
 from frappe.utils import now_datetime
+from frappe_ai.api import json_utils
 from frappe_ai.api.tool_orchestrator import openai_responses_call
 
+def _logger():
+	return frappe.logger("frappe_ai.sales_bot", allow_site=True, file_count=20)
+
+# Direct senders used when the AI didn't deliver the reply itself. They come
+# from the optional frappe_whatsapp app and are resolved once at import.
+try:
+	from frappe_whatsapp.frappe_whatsapp.doctype.whatsapp_message.whatsapp_message import send_whatsapp_message
+except ImportError:
+	send_whatsapp_message = None
+try:
+	from frappe_whatsapp.frappe_whatsapp.doctype.instagram_message.instagram_message import send_instagram_message
+except ImportError:
+	send_instagram_message = None
+
+_SENDERS = {
+	channel: sender
+	for channel, sender in (("WhatsApp", send_whatsapp_message), ("Instagram", send_instagram_message))
+	if sender is not None
+}
+
+# Parsed conversation histories are cached so each turn skips re-parsing
+# the stored JSON blob.
+HISTORY_CACHE_TTL = 6 * 60 * 60
+
+# The ongoing conversation per (channel, customer) is cached to skip a lookup
+# on every inbound message; the TTL bounds staleness from out-of-band edits.
+ONGOING_CONVERSATION_CACHE_TTL = 24 * 60 * 60
+
+SALES_BOT_MODEL = "gpt-4.1"
+
+# Turns of local history sent when a conversation can't be continued from
+# the stored response (first turn, the response expired, or the chain is
+# restarted every HISTORY_WINDOW turns to keep it from growing unbounded)
+HISTORY_WINDOW = 40
+
+# Lifetime of the per-conversation drain lock; longer than the short queue's
+# job timeout so a killed worker can't leave it held for good.
+DRAIN_LOCK_TIMEOUT = 10 * 60
+
+# Inboxes expire when no message arrives for this long, so the inbox of a
+# conversation that is never drained again doesn't outlive it in Redis.
+INBOX_TTL = 24 * 60 * 60
+
+_INBOX_PREFIX = "sales_conversation_inbox:"
+
+# MCP tools through which the AI delivers its reply to the customer
+_SEND_TOOLS = frozenset({"send_whatsapp_message", "send_instagram_message"})
+
+
+def _history_cache_key(docname: str) -> str:
+	return f"sales_conversation_history:{docname}"
+
+
+def _inbox_key(docname: str) -> str:
+	return f"{_INBOX_PREFIX}{docname}"
+
+
+def _drain_lock_key(docname: str) -> str:
+	return f"sales_conversation_drain:{docname}"
+
+
+def _ongoing_conversation_key(channel: str, customer_identifier: str) -> str:
+	return f"sales_conversation_ongoing:{channel}:{customer_identifier}"
+
+
+def load_history(docname: str) -> list:
+	"""
+	Returns the conversation history as a list, from cache when warm. On a
+	miss it is read straight from the database, since the cached document
+	does not see the history written by `frappe.db.set_value`.
+	"""
+	history = frappe.cache().get_value(_history_cache_key(docname))
+	if history is not None:
+		return history
+	return _parse_history(frappe.db.get_value("Sales Conversation", docname, "conversation_history"))
+
+
+def _parse_history(stored) -> list:
+	try:
+		return json.loads(stored) if stored else []
+	except (json.JSONDecodeError, TypeError):
+		return []
+
+
+def _starts_new_chain(history_length: int, new_turns: int) -> bool:
+	"""
+	Whether a turn resends the windowed history instead of continuing the
+	stored response chain: it does whenever the history, `new_turns` included,
+	crosses a multiple of HISTORY_WINDOW, so a chain never carries much more
+	than two windows of turns.
+	"""
+	return (history_length - new_turns) // HISTORY_WINDOW != history_length // HISTORY_WINDOW
+
+
+def send_direct_message(channel: str, **kwargs) -> bool:
+	"""
+	Sends a message through the channel's frappe_whatsapp sender. Returns
+	False when the channel has no sender (or frappe_whatsapp isn't installed).
+	"""
+	sender = _SENDERS.get(channel)
+	if sender is None:
+		return False
+	# frappe.call with the function itself skips the dotted-path lookup but
+	# still drops kwargs the sender doesn't accept
+	frappe.call(sender, **kwargs)
+	return True
+
+
+def build_system_prompt(doc) -> str:
+	"""The sales assistant instructions; they only depend on fields fixed at creation."""
+	return (
+		f"You are a professional sales assistant handling a {doc.channel} conversation with customer {doc.customer_identifier}. "
+		f"IMPORTANT: Always respond in English language only."
+		f"After responding to their message, send your response back to them using the appropriate send_{doc.channel.lower()}_message tool. "
+		f"Be helpful, professional, and concise in your responses. "
+		f"Reference: Sales Conversation {doc.name}"
+	)
+
+
 class SalesConversation(Document):
-	pass
+	def after_insert(self):
+		# Built once per conversation rather than on every turn
+		self.db_set("system_prompt", build_system_prompt(self), update_modified=False)
+
+	def on_update(self):
+		# Edits made outside process_message must not be masked by the cache
+		frappe.cache().delete_value(_history_cache_key(self.name))
+		if self.status != "Ongoing":
+			frappe.cache().delete_value(_ongoing_conversation_key(self.channel, self.customer_identifier))
+
+	def on_trash(self):
+		frappe.cache().delete_value(_ongoing_conversation_key(self.channel, self.customer_identifier))
+		frappe.cache().delete_value(_inbox_key(self.name))
 
-def process_message(docname: str, user_message: str):
+
+def _queue_message(docname: str, message: str):
+	"""Appends a message to the conversation's inbox and renews the inbox's expiry."""
+	cache = frappe.cache()
+	inbox = cache.make_key(_inbox_key(docname))
+	pipeline = cache.pipeline()
+	pipeline.rpush(inbox, message)
+	pipeline.expire(inbox, INBOX_TTL)
+	pipeline.execute()
+
+def drain_conversation(docname: str):
+	"""
+	Background job that answers the messages waiting in the conversation's
+	inbox, one LLM call per batch. Drains of the same conversation are
+	serialized by a lock; a job that can't take it returns, since the holder
+	re-checks the inbox after releasing it. Messages leave the inbox only
+	once their turn is committed; the ones a failed drain leaves behind are
+	picked up by `requeue_stalled_drains`.
+	"""
+	cache = frappe.cache()
+	inbox = _inbox_key(docname)
+	if not frappe.db.exists("Sales Conversation", docname):
+		cache.delete_value(inbox)
+		return
+	lock = cache.lock(cache.make_key(_drain_lock_key(docname)), timeout=DRAIN_LOCK_TIMEOUT)
+	while True:
+		if not lock.acquire(blocking=False):
+			return
+		try:
+			while pending := cache.lrange(inbox, 0, -1):
+				process_message(docname, [frappe.safe_decode(message) for message in pending])
+				frappe.db.commit()
+				# Messages pushed in the meantime sit after the processed ones
+				cache.ltrim(inbox, len(pending), -1)
+		finally:
+			lock.release()
+		if not cache.llen(inbox):
+			return
+
+
+def requeue_stalled_drains():
+	"""
+	Scheduled every minute: enqueues a drain for every inbox still holding
+	messages. This is the delayed retry for a drain that failed or whose
+	worker was killed (the latter once its lock expires); jobs finding the
+	lock held just return.
+	"""
+	for key in frappe.cache().get_keys(_INBOX_PREFIX):
+		docname = frappe.safe_decode(key).split(_INBOX_PREFIX, 1)[1]
+		frappe.enqueue(
+			"frappe_ai.frappe_ai.doctype.sales_conversation.sales_conversation.drain_conversation",
+			queue="short",
+			job_id=f"sales_conversation_drain:{docname}",
+			deduplicate=True,
+			docname=docname
+		)
+
+
+def process_message(docname: str, user_message: str | list[str]):
 	"""
 	This is the background job that processes the user's message,
 	calls the LLM, and sends a reply.
 	The AI handles the complete conversation including sending the response.
+	`user_message` may be a list of messages received in a burst; each becomes
+	its own user turn. Must run under the drain lock, see `drain_conversation`.
 	"""
-	print(f"--- BACKGROUND JOB: STARTED for doc {docname} ---")
-	doc = frappe.get_doc("Sales Conversation", docname)
-	try:
-		history = json.loads(doc.conversation_history) if doc.conversation_history else []
-	except (json.JSONDecodeError, TypeError):
-		history = []
-	history.append({"role": "user", "content": user_message})
+	_logger().debug("Processing messages for Sales Conversation %s", docname)
+	# Only the fields that never change after creation are read off the
+	# cached document; the history is loaded on its own.
+	doc = frappe.get_cached_doc("Sales Conversation", docname)
+	history = load_history(docname)
+	user_messages = [user_message] if isinstance(user_message, str) else user_message
+	new_turns = [{"role": "user", "content": message} for message in user_messages]
+	history.extend(new_turns)
 	
 	try:
-		print(f"--- BACKGROUND JOB: Step 1: Calling LLM for doc {doc.name} ---")
-		
-		# Add system context to help AI understand what to do
-		enhanced_messages = [
-			{
-				"role": "system", 
-				"content": f"You are a professional sales assistant handling a {doc.channel} conversation with customer {doc.customer_identifier}. "
-				f"IMPORTANT: Always respond in English language only."
-				f"After responding to their message, send your response back to them using the appropriate send_{doc.channel.lower()}_message tool. "
-				f"Be helpful, professional, and concise in your responses. "
-				f"Reference: Sales Conversation {doc.name}"
-			}
-		] + history
-		
-		llm_response_obj = openai_responses_call(
-			model_id="gpt-4.1", # Corrected model ID from user
-			messages=enhanced_messages
-		)
-		print(f"--- BACKGROUND JOB: Step 2: LLM call successful for doc {doc.name} ---")
-
-		# Extract the assistant's message for conversation history
-		bot_reply_text = ""
-		if hasattr(llm_response_obj, 'output') and llm_response_obj.output:
-			for item in llm_response_obj.output:
-				if hasattr(item, 'type') and item.type == 'message' and hasattr(item, 'role') and item.role == 'assistant':
-					if hasattr(item, 'content') and isinstance(item.content, list):
-						for content_part in item.content:
-							if hasattr(content_part, 'type') and content_part.type == 'output_text':
-								bot_reply_text += content_part.text
-					# If we found text, we can stop processing this item
-					if bot_reply_text:
-						break
+		_logger().debug("Calling LLM for Sales Conversation %s", doc.name)
 		
+		# OpenAI keeps the earlier turns server-side, so a continued
+		# conversation only sends what is new
+		previous_response_id = frappe.db.get_value("Sales Conversation", docname, "last_response_id")
+		llm_response_obj = None
+		# A continued chain carries every turn since it started, so it is
+		# periodically restarted from the window
+		if previous_response_id and not _starts_new_chain(len(history), len(new_turns)):
+			try:
+				llm_response_obj = openai_responses_call(
+					model_id=SALES_BOT_MODEL,
+					messages=new_turns,
+					previous_response_id=previous_response_id,
+					truncation="auto"
+				)
+			except (openai.NotFoundError, openai.BadRequestError) as e:
+				if getattr(e, "code", None) != "previous_response_not_found" and not isinstance(e, openai.NotFoundError):
+					raise
+				_logger().debug("Stored response for Sales Conversation %s expired, resending history", doc.name)
+
+		if llm_response_obj is None:
+			# Add system context to help AI understand what to do
+			# Only the most recent turns are sent; the full history stays on the doc
+			enhanced_messages = [
+				{"role": "system", "content": doc.system_prompt or build_system_prompt(doc)},
+				*history[-HISTORY_WINDOW:],
+			]
+			llm_response_obj = openai_responses_call(
+				model_id=SALES_BOT_MODEL,
+				messages=enhanced_messages,
+				truncation="auto"
+			)
+		_logger().debug("LLM call successful for Sales Conversation %s", doc.name)
+
+		# One pass over the output: collect the assistant's text for the
+		# conversation history and note whether the AI already sent the reply
+		bot_reply_parts = []
+		send_tool_used = None
+		for item in getattr(llm_response_obj, 'output', None) or ():
+			item_type = getattr(item, 'type', None)
+			if item_type == 'mcp_call':
+				tool_name = getattr(item, 'name', '')
+				if send_tool_used is None and tool_name in _SEND_TOOLS:
+					send_tool_used = tool_name
+			elif item_type == 'message' and not bot_reply_parts and getattr(item, 'role', None) == 'assistant':
+				# Only the first assistant message with text is kept
+				for content_part in getattr(item, 'content', None) or ():
+					if getattr(content_part, 'type', None) == 'output_text' and content_part.text:
+						bot_reply_parts.append(content_part.text)
+		bot_reply_text = "".join(bot_reply_parts)
+
 		if not bot_reply_text:
 			bot_reply_text = "Sorry, I encountered an issue and cannot respond at the moment."
-			print(f"--- BACKGROUND JOB: WARNING: LLM response did not contain message content for {doc.name} ---")
+			_logger().warning("LLM response did not contain message content for Sales Conversation %s", doc.name)
 			frappe.log_error("Sales Bot: LLM response did not contain assistant message content.", llm_response_obj.model_dump_json(indent=2))
 
-		print(f"--- BACKGROUND JOB: Step 3: Saving conversation history for doc {doc.name} ---")
+		# Write just the changed fields instead of a full doc.save(). The reply
+		# may already be delivered, so the turn is never discarded: its entries
+		# are appended to the history as stored now, locked until the commit.
+		# (The parent's modified moves whenever a Communication is linked to it,
+		# so it can't serve as a guard here.)
+		history = _parse_history(
+			frappe.db.get_value("Sales Conversation", docname, "conversation_history", for_update=True)
+		)
+		history.extend(new_turns)
 		history.append({"role": "assistant", "content": bot_reply_text})
-		doc.conversation_history = json.dumps(history, indent=4)
-		doc.last_interaction = now_datetime()
-		doc.save(ignore_permissions=True)
-		frappe.db.commit()
-		print(f"--- BACKGROUND JOB: Step 4: Document saved successfully for doc {doc.name} ---")
+		now = now_datetime()
+		frappe.db.set_value(
+			"Sales Conversation",
+			doc.name,
+			{
+				"conversation_history": json_utils.dumps(history).decode(),
+				"last_interaction": now,
+				"last_response_id": llm_response_obj.id,
+				"modified": now,
+			},
+			update_modified=False,
+		)
+		# Committed by drain_conversation once per drained burst. Cache and UI
+		# only see the new history once it is durable.
+		frappe.db.after_commit.add(
+			lambda: frappe.cache().set_value(_history_cache_key(docname), history, expires_in_sec=HISTORY_CACHE_TTL)
+		)
+		frappe.publish_realtime(
+			"doc_update",
+			{"modified": now, "doctype": doc.doctype, "name": doc.name},
+			doctype=doc.doctype,
+			docname=doc.name,
+			after_commit=True,
+		)
+		_logger().debug("Saved conversation history for Sales Conversation %s", doc.name)
 
 		# The AI should have already sent the message using MCP tools
-		# Check if any send_*_message tools were called in the response
-		message_sent = False
-		if hasattr(llm_response_obj, 'output') and llm_response_obj.output:
-			for item in llm_response_obj.output:
-				if hasattr(item, 'type') and item.type == 'mcp_call':
-					tool_name = getattr(item, 'name', '')
-					if tool_name in ['send_whatsapp_message', 'send_instagram_message']:
-						message_sent = True
-						print(f"--- BACKGROUND JOB: ✅ AI sent message using {tool_name} for doc {doc.name} ---")
-						break
-		
-		if not message_sent:
-			print(f"--- BACKGROUND JOB: ⚠️ AI did not send message, falling back to direct call for doc {doc.name} ---")
+		if send_tool_used:
+			_logger().debug("AI sent message using %s for Sales Conversation %s", send_tool_used, doc.name)
+		else:
+			_logger().debug("AI did not send message, falling back to direct call for Sales Conversation %s", doc.name)
 			# Fallback: direct call if AI didn't send the message
-			if doc.channel == "WhatsApp":
-				frappe.call(
-					"frappe_whatsapp.frappe_whatsapp.doctype.whatsapp_message.whatsapp_message.send_whatsapp_message",
-					to=doc.customer_identifier,
-					message=bot_reply_text,
-					reference_doctype="Sales Conversation",
-					reference_name=doc.name
-				)
-				print(f"--- BACKGROUND JOB: Fallback WhatsApp message sent for doc {doc.name} ---")
-			elif doc.channel == "Instagram":
-				frappe.call(
-					"frappe_whatsapp.frappe_whatsapp.doctype.instagram_message.instagram_message.send_instagram_message",
-					to=doc.customer_identifier,
-					message=bot_reply_text,
-					reference_doctype="Sales Conversation",
-					reference_name=doc.name
+			if not send_direct_message(
+				doc.channel,
+				to=doc.customer_identifier,
+				message=bot_reply_text,
+				reference_doctype="Sales Conversation",
+				reference_name=doc.name
+			):
+				_logger().error("Cannot send reply, unsupported channel %s for Sales Conversation %s", doc.channel, doc.name)
+				frappe.log_error(
+					f"Sales Bot: reply for Sales Conversation {doc.name} was not delivered, no sender for channel {doc.channel}",
+					doc.name,
 				)
-				print(f"--- BACKGROUND JOB: Fallback Instagram message sent for doc {doc.name} ---")
 		
-		print(f"--- BACKGROUND JOB: FINISHED doc {doc.name} ---")
+		_logger().debug("Finished processing Sales Conversation %s", doc.name)
 
 	except Exception as e:
-		# This will print the exact error to the console
-		print(f"--- BACKGROUND JOB: CRITICAL ERROR for doc {doc.name}: {e} ---")
 		frappe.log_error(f"Sales Bot: Error during LLM call or processing. Error: {e}", doc.name)
 		error_message = "I'm sorry, I'm having trouble connecting right now. Please try again in a moment."
 		
 		# Send error message using channel-specific methods
 		try:
-			if doc.channel == "WhatsApp":
-				frappe.call(
-					"frappe_whatsapp.frappe_whatsapp.doctype.whatsapp_message.whatsapp_message.send_whatsapp_message",
-					to=doc.customer_identifier,
-					message=error_message
-				)
-			elif doc.channel == "Instagram":
-				frappe.call(
-					"frappe_whatsapp.frappe_whatsapp.doctype.instagram_message.instagram_message.send_instagram_message",
-					to=doc.customer_identifier,
-					message=error_message
-				)
-			else:
-				print(f"--- ERROR: Cannot send error message, unsupported channel {doc.channel} ---")
+			if not send_direct_message(doc.channel, to=doc.customer_identifier, message=error_message):
+				_logger().error("Cannot send error message, unsupported channel %s", doc.channel)
 		except Exception as send_error:
-			print(f"--- ERROR: Failed to send error message: {send_error} ---")
 			frappe.log_error(f"Failed to send error message via {doc.channel}: {send_error}", "Sales Bot Error Send Failed")
 
 @frappe.whitelist()
 def ingest_message(channel: str, customer_identifier: str, user_message: str):
 	try:
-		print(f"=== INGESTING MESSAGE ===")
-		print(f"Channel: {channel}, Customer: {customer_identifier}, Message: {user_message[:50]}...")
+		_logger().debug("Ingesting %s message from %s", channel, customer_identifier)
 		
-		doc_name = frappe.db.exists(
-			"Sales Conversation", {"customer_identifier": customer_identifier, "channel": channel, "status": "Ongoing"}
-		)
+		cache_key = _ongoing_conversation_key(channel, customer_identifier)
+		doc_name = frappe.cache().get_value(cache_key)
 
 		if not doc_name:
-			print(f"Creating new Sales Conversation for {channel} - {customer_identifier}")
-			doc = frappe.new_doc("Sales Conversation")
-			doc.channel = channel
-			doc.customer_identifier = customer_identifier
-			doc.insert(ignore_permissions=True)
-			doc_name = doc.name
-			print(f"Created Sales Conversation: {doc_name}")
-		else:
-			print(f"Found existing Sales Conversation: {doc_name}")
-		
-		# Correct enqueue path
+			doc_name = frappe.db.exists(
+				"Sales Conversation", {"customer_identifier": customer_identifier, "channel": channel, "status": "Ongoing"}
+			)
+			if not doc_name:
+				doc = frappe.new_doc("Sales Conversation")
+				doc.channel = channel
+				doc.customer_identifier = customer_identifier
+				doc.insert(ignore_permissions=True)
+				doc_name = doc.name
+				_logger().debug("Created Sales Conversation %s for %s - %s", doc_name, channel, customer_identifier)
+
+			# Only cache a conversation that is known to be committed
+			frappe.db.after_commit.add(
+				lambda: frappe.cache().set_value(cache_key, doc_name, expires_in_sec=ONGOING_CONVERSATION_CACHE_TTL)
+			)
+
+		# Queue the message on the conversation's inbox; the drain job answers
+		# everything waiting there in one LLM call. Both wait for the commit so
+		# the drain never runs ahead of a conversation that is still being inserted.
+		frappe.db.after_commit.add(lambda: _queue_message(doc_name, user_message))
 		frappe.enqueue(
-			"frappe_ai.frappe_ai.doctype.sales_conversation.sales_conversation.process_message",
+			"frappe_ai.frappe_ai.doctype.sales_conversation.sales_conversation.drain_conversation",
 			queue="short",
-			docname=doc_name,
-			user_message=user_message
+			enqueue_after_commit=True,
+			docname=doc_name
 		)
 		
-		print(f"✅ Message enqueued for processing: {doc_name}")
+		_logger().debug("Message enqueued for Sales Conversation %s", doc_name)
 		return {"status": "success", "message": "Message enqueued for processing.", "conversation_id": doc_name}
 	
 	except Exception as e:
-		print(f"❌ ERROR in ingest_message: {str(e)}")
 		frappe.log_error("ingest_message: CRITICAL ERROR", str(e))
 		raise 
\ No newline at end of file
@@ -4,6 +4,8 @@
 # import frappe
 from frappe.tests import IntegrationTestCase, UnitTestCase
 
+from frappe_ai.frappe_ai.doctype.sales_conversation.sales_conversation import HISTORY_WINDOW, _starts_new_chain
+
 
 # On IntegrationTestCase, the doctype test records and all
 # link-field test record dependencies are recursively loaded
@@ -18,7 +20,18 @@ class UnitTestAISetting(UnitTestCase):
 	Use this class for testing individual functions and methods.
 	"""
 
-	pass
+	def test_chain_continues_within_a_window(self):
+		self.assertFalse(_starts_new_chain(1, 1))
+		self.assertFalse(_starts_new_chain(HISTORY_WINDOW - 1, 1))
+		self.assertFalse(_starts_new_chain(HISTORY_WINDOW + 1, 1))
+		self.assertFalse(_starts_new_chain(2 * HISTORY_WINDOW - 1, 3))
+
+	def test_chain_restarts_when_history_crosses_a_window(self):
+		self.assertTrue(_starts_new_chain(HISTORY_WINDOW, 1))
+		self.assertTrue(_starts_new_chain(HISTORY_WINDOW + 1, 2))
+		self.assertTrue(_starts_new_chain(2 * HISTORY_WINDOW, 1))
+		# A burst longer than a window always restarts
+		self.assertTrue(_starts_new_chain(HISTORY_WINDOW + 10, HISTORY_WINDOW + 5))
 
 
 class IntegrationTestAISetting(IntegrationTestCase):
@@ -153,6 +153,9 @@ scheduler_events = {
 	"cron": {
 		"*/5 * * * *": [
 			"frappe_ai.api.tasks.check_and_manage_mcp_server"
+		],
+		"* * * * *": [
+			"frappe_ai.frappe_ai.doctype.sales_conversation.sales_conversation.requeue_stalled_drains"
 		]
 	}
 }
@@ -205,7 +208,7 @@ scheduler_events = {
 
 # Request Events
 # ----------------
-# before_request = ["frappe_ai.utils.before_request"]
+before_request = ["frappe_ai.utils.pre_warm_connections"]
 # after_request = ["frappe_ai.utils.after_request"]
 
 # Job Events
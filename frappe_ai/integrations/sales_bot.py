@@ -1,115 +1,133 @@
 import frappe
+import hashlib
+import re
+from lxml import etree
+from lxml import html as lhtml
 from frappe_ai.frappe_ai.doctype.sales_conversation.sales_conversation import ingest_message
 
+def _logger():
+    # Resolved per call: allow_site picks the current site's log file, and
+    # frappe.logger caches the instance per site.
+    return frappe.logger("frappe_ai.sales_bot", allow_site=True, file_count=20)
+
+# Communication mediums the Sales Bot answers
+SUPPORTED_CHANNELS = frozenset({"WhatsApp", "Instagram", "SMS", "Phone Call"})
+
+# Compiled once: the last `message-entry` div (matched as a class token, like
+# BeautifulSoup's class_ filter) and the first <strong>/<div> inside an entry.
+_LAST_MESSAGE_ENTRY = etree.XPath(
+    "(//div[contains(concat(' ', normalize-space(@class), ' '), ' message-entry ')])[last()]"
+)
+_FIRST_STRONG_TEXT = etree.XPath("string((.//strong)[1])")
+_FIRST_DIV = etree.XPath("(.//div)[1]")
+
+# Direction arrows in the rendered entries, and any HTML tag (fallback path)
+_ARROWS = re.compile(r'[→←]')
+_TAGS = re.compile(r'<[^>]+>')
+
+# The sender tag the conversation renderer writes for messages sent by us, and
+# how much of the content's tail is scanned for it before parsing.
+_BOT_SENDER_TAG = "<strong>You</strong>"
+BOT_CHECK_TAIL_CHARS = 4096
+
 def process_incoming_communication(doc, method):
     """
     This function is triggered by a hook on the Communication DocType.
     It checks if the message is incoming and from a supported channel, then passes it to the Sales Bot.
     Now handles conversation-based messages where new messages are appended to existing conversations.
+    Only the cheap routing checks run here; parsing the content and ingesting
+    the message happen in a background job so the hook doesn't hold up the
+    request that saved the Communication.
     """
-    print("================== SALES BOT HOOK CALLED ==================")
-    print(f"--- Sales Bot Hook Triggered for Communication: {doc.name}, Method: {method} ---")
-    print(f"--- Doc Type: {doc.doctype}, Medium: {doc.communication_medium} ---")
-    print(f"--- Sent or Received: {doc.sent_or_received} ---")
-    
-    
-    # CRITICAL: We only care about incoming messages from supported channels
-    if doc.sent_or_received != "Received":
-        print(f"--- Sales Bot Hook Skipped: Not a 'Received' message. Type is '{doc.sent_or_received}'. ---")
+    # CRITICAL: We only care about incoming messages from supported channels.
+    # Checked first since most Communications are neither.
+    if doc.sent_or_received != "Received" or doc.communication_medium not in SUPPORTED_CHANNELS:
         return
 
-    # Only process supported communication mediums
-    supported_channels = ["WhatsApp", "Instagram", "SMS", "Phone Call"]
-    if doc.communication_medium not in supported_channels:
-        print(f"--- Sales Bot Hook Skipped: Unsupported medium '{doc.communication_medium}'. ---")
-        return
-    
+    _logger().debug("Sales Bot hook triggered for Communication %s (%s)", doc.name, method)
+
     # CRITICAL: Skip if this Communication was created by the sales bot (avoid infinite loop)
     # Check if this is a bot response by looking at the reference
     if doc.reference_doctype == "Sales Conversation":
-        print(f"--- Sales Bot Hook Skipped: This Communication references a Sales Conversation, likely a bot response ---")
+        _logger().debug("Sales Bot hook skipped: Communication references a Sales Conversation, likely a bot response")
         return
 
-    # For our new conversation-based approach, process conversations linked to Contacts
-    if doc.reference_doctype == "Contact":
-        # This is a conversation document linked to a contact
-        # Get identifier based on communication medium
-        if doc.communication_medium == "WhatsApp":
-            customer_identifier = doc.sender_phone or doc.phone_no
-        elif doc.communication_medium == "Instagram":
-            customer_identifier = doc.instagram
-        else:
-            customer_identifier = doc.sender_phone or doc.phone_no or doc.sender
-        
-        channel = doc.communication_medium
-        
-        # Extract the latest message from the conversation content
-        # The content contains HTML-formatted messages, we need to extract the latest one
-        if doc.content:
-            print(f"--- DEBUG: Raw content length: {len(doc.content)} ---")
-            print(f"--- DEBUG: Raw content preview: {doc.content[:200]}... ---")
-            user_message, is_bot_message = extract_latest_message_from_content(doc.content)
-            print(f"--- DEBUG: Extracted message: '{user_message}' ---")
-            print(f"--- DEBUG: Is bot message: {is_bot_message} ---")
-            
-            # CRITICAL: Skip if the latest message is from the bot (sent by "You")
-            if is_bot_message:
-                print(f"--- Sales Bot Hook Skipped: Latest message is from bot (sender: 'You') ---")
-                return
-        else:
-            user_message = None
-            print(f"--- DEBUG: No content in document ---")
-            
-    elif not doc.reference_doctype:
-        # This might be an unlinked conversation
-        # Get identifier based on communication medium
-        if doc.communication_medium == "WhatsApp":
-            customer_identifier = doc.sender_phone or doc.phone_no
-        elif doc.communication_medium == "Instagram":
-            customer_identifier = doc.instagram
-        else:
-            customer_identifier = doc.sender_phone or doc.phone_no or doc.sender
-        
-        channel = doc.communication_medium
-        
-        if doc.content:
-            print(f"--- DEBUG: Unlinked conversation content length: {len(doc.content)} ---")
-            user_message, is_bot_message = extract_latest_message_from_content(doc.content)
-            print(f"--- DEBUG: Extracted message from unlinked: '{user_message}' ---")
-            print(f"--- DEBUG: Is bot message: {is_bot_message} ---")
-            
-            # CRITICAL: Skip if the latest message is from the bot (sent by "You")
-            if is_bot_message:
-                print(f"--- Sales Bot Hook Skipped: Latest message is from bot (sender: 'You') ---")
-                return
-        else:
-            user_message = None
-            print(f"--- DEBUG: No content in unlinked conversation ---")
-    else:
-        # Skip other types of communications
-        print(f"--- Sales Bot Hook Skipped: Not a conversation document. Reference: {doc.reference_doctype} ---")
+    # Conversations are either linked to a Contact or not linked at all;
+    # skip other types of communications
+    if doc.reference_doctype and doc.reference_doctype != "Contact":
+        _logger().debug("Sales Bot hook skipped: not a conversation document (reference %s)", doc.reference_doctype)
         return
 
-    if not customer_identifier or not user_message:
-        print(f"--- Sales Bot Hook Skipped: Missing identifier or content. Identifier: '{customer_identifier}', Message: '{user_message}' ---")
-        frappe.log_error(
-            "Sales Bot Hook Skipped",
-            f"Missing identifier or content. Identifier: '{customer_identifier}', Message: '{user_message}'",
+    # Get identifier based on communication medium
+    if doc.communication_medium == "WhatsApp":
+        customer_identifier = doc.sender_phone or doc.phone_no
+    elif doc.communication_medium == "Instagram":
+        customer_identifier = doc.instagram
+    else:
+        customer_identifier = doc.sender_phone or doc.phone_no or doc.sender
+
+    if not customer_identifier or not doc.content:
+        _logger().warning(
+            "Sales Bot hook skipped: missing identifier or content. Identifier: %r, Communication: %s",
+            customer_identifier, doc.name,
         )
         return
 
-    # If all checks pass, ingest the message into the sales conversation engine
-    print(f"--- Sales Bot Hook SUCCESS: Calling ingest_message for {customer_identifier} ---")
-    frappe.log_error(
-        "Sales Bot Hook SUCCESS: Calling ingest_message",
-        f"From: {customer_identifier} | Channel: {channel} | Message: {user_message}",
+    # CRITICAL: Skip if the latest message is from the bot (sent by "You")
+    if _is_bot_message_fast(doc.content):
+        _logger().debug("Sales Bot hook skipped: latest message is from the bot")
+        return
+
+    # The content is passed along so the job answers exactly this version of
+    # the conversation; identical content (hook re-entry, retries) is queued once.
+    content_digest = hashlib.blake2b(doc.content.encode(), digest_size=16).hexdigest()
+    job_id = f"sales_bot_communication:{doc.name}:{content_digest}"
+    # insert() fires after_insert and on_update in the same transaction, and
+    # RQ-level deduplication can't see jobs that only get enqueued at commit
+    queued = frappe.flags.setdefault("sales_bot_queued_communications", set())
+    if job_id in queued:
+        return
+    queued.add(job_id)
+    frappe.enqueue(
+        "frappe_ai.integrations.sales_bot.process_communication_content",
+        queue="short",
+        job_id=job_id,
+        deduplicate=True,
+        enqueue_after_commit=True,
+        communication=doc.name,
+        channel=doc.communication_medium,
+        customer_identifier=customer_identifier,
+        content=doc.content,
     )
-    
+
+
+def process_communication_content(communication: str, channel: str, customer_identifier: str, content: str):
+    """
+    Background job for `process_incoming_communication`. Extracts the latest
+    message from the conversation content and ingests it into the Sales Bot.
+    """
+    # Extract the latest message from the conversation content
+    # The content contains HTML-formatted messages, we need to extract the latest one
+    user_message, is_bot_message = extract_latest_message_from_content(content)
+    _logger().debug("Extracted message %r from Communication %s (bot message: %s)", user_message, communication, is_bot_message)
+
+    # CRITICAL: Skip if the latest message is from the bot (sent by "You")
+    if is_bot_message:
+        _logger().debug("Sales Bot hook skipped: latest message is from the bot")
+        return
+
+    if not user_message:
+        _logger().warning("Sales Bot hook skipped: no message found in Communication %s", communication)
+        return
+
+    # If all checks pass, ingest the message into the sales conversation engine
+    _logger().debug("Sales Bot hook: ingesting %s message from %s", channel, customer_identifier)
+
     ingest_message(
         channel=channel,
         customer_identifier=customer_identifier,
         user_message=user_message,
-    ) 
+    )
 
 
 def extract_latest_message_from_content(html_content):
@@ -118,66 +136,66 @@ def extract_latest_message_from_content(html_content):
     The content contains multiple message entries, we want the most recent one.
     Returns tuple: (message_text, is_bot_message)
     """
+    # Replies sent by the bot are dropped by the caller; spot them without parsing
+    if html_content and _is_bot_message_fast(html_content):
+        return None, True
+    return _extract_latest_message(html_content)
+
+
+def _is_bot_message_fast(html_content):
+    """
+    Cheap tail scan for the common bot-reply case: True only when the first
+    <strong> of the last message entry is exactly "You". Any other shape is
+    inconclusive and falls through to the full parse.
+    """
+    tail = html_content[-BOT_CHECK_TAIL_CHARS:]
+    entry_at = tail.rfind('message-entry')
+    if entry_at == -1:
+        return False
+    strong_at = tail.find('<strong', entry_at)
+    return strong_at != -1 and tail.startswith(_BOT_SENDER_TAG, strong_at)
+
+
+def _extract_latest_message(html_content):
     try:
-        from bs4 import BeautifulSoup
-        import re
-        
-        print(f"--- DEBUG: Parsing HTML content of length {len(html_content)} ---")
-        
-        # Parse the HTML content
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Find all message entries (our formatted divs)
-        message_entries = soup.find_all('div', class_='message-entry')
-        print(f"--- DEBUG: Found {len(message_entries)} message entries ---")
+        # Parse the HTML content with libxml2 and select only the last
+        # message entry (our formatted divs) instead of materializing them all
+        tree = lhtml.fromstring(html_content)
+        message_entries = _LAST_MESSAGE_ENTRY(tree)
         
         if message_entries:
             # Get the last (most recent) message entry
-            latest_entry = message_entries[-1]
-            print(f"--- DEBUG: Latest entry HTML: {str(latest_entry)[:200]}... ---")
+            latest_entry = message_entries[0]
             
             # Check if this is a bot message by looking for "You" as the sender
-            sender_strong = latest_entry.find('strong')
-            is_bot_message = False
-            if sender_strong:
-                sender_text = sender_strong.get_text().strip()
-                is_bot_message = sender_text == "You"
-                print(f"--- DEBUG: Sender text: '{sender_text}', Is bot: {is_bot_message} ---")
+            sender_text = _FIRST_STRONG_TEXT(latest_entry).strip()
+            is_bot_message = sender_text == "You"
             
             # Extract text content, removing sender name and timestamp
             # The structure is: <strong>Sender</strong> <span>timestamp</span> arrow
             #                   <div>actual message content</div>
-            content_div = latest_entry.find('div')
-            if content_div:
-                message_text = content_div.get_text().strip()
-                print(f"--- DEBUG: Found content div with text: '{message_text}' ---")
+            content_divs = _FIRST_DIV(latest_entry)
+            if content_divs:
+                message_text = content_divs[0].text_content().strip()
                 return message_text, is_bot_message
             else:
                 # Fallback: get all text and try to extract message part
-                full_text = latest_entry.get_text().strip()
-                print(f"--- DEBUG: No content div, using full text: '{full_text}' ---")
+                full_text = latest_entry.text_content().strip()
                 # Remove arrows and extra whitespace
-                full_text = re.sub(r'[→←]', '', full_text).strip()
+                full_text = _ARROWS.sub('', full_text).strip()
                 # Try to get everything after timestamp (rough heuristic)
                 lines = full_text.split('\n')
                 if len(lines) > 1:
                     result = lines[-1].strip()
-                    print(f"--- DEBUG: Using last line: '{result}' ---")
                     return result, is_bot_message
-                print(f"--- DEBUG: Using full text: '{full_text}' ---")
                 return full_text, is_bot_message
         else:
             # Fallback: if no structured message entries, get plain text
-            plain_text = soup.get_text().strip()
-            print(f"--- DEBUG: No message entries found, using plain text: '{plain_text}' ---")
+            plain_text = tree.text_content().strip()
             return plain_text, False
             
     except Exception as e:
-        error_msg = f"Error extracting latest message from content: {str(e)}"
-        print(f"--- DEBUG: {error_msg} ---")
-        frappe.logger().error(error_msg)
+        _logger().error("Error extracting latest message from content: %s", e)
         # Fallback: return the raw content stripped of HTML
-        import re
-        fallback = re.sub(r'<[^>]+>', '', html_content).strip() if html_content else None
-        print(f"--- DEBUG: Using fallback text: '{fallback}' ---")
+        fallback = _TAGS.sub('', html_content).strip() if html_content else None
         return fallback, False 
\ No newline at end of file
@@ -0,0 +1,41 @@
+# Copyright (c) 2025, arvis and Contributors
+# See license.txt
+
+from frappe.tests import UnitTestCase
+
+from frappe_ai.integrations.sales_bot import (
+    _extract_latest_message,
+    _is_bot_message_fast,
+    extract_latest_message_from_content,
+)
+
+
+def _entry(sender, body):
+    return f'<div class="message-entry"><strong>{sender}</strong> <span>10:42</span> → {body}</div>'
+
+
+class UnitTestSalesBot(UnitTestCase):
+    """Unit tests for reading the latest message off a Communication."""
+
+    def test_latest_entry_message_is_read_from_its_div(self):
+        content = _entry("Ayşe", "<div>First question</div>") + _entry("Ayşe", "<div> Is it in stock? </div>")
+        self.assertEqual(extract_latest_message_from_content(content), ("Is it in stock?", False))
+
+    def test_entry_without_div_falls_back_to_last_line(self):
+        content = _entry("Ayşe", "\nHello there")
+        self.assertEqual(extract_latest_message_from_content(content), ("Hello there", False))
+
+    def test_plain_text_content_is_returned_as_is(self):
+        self.assertEqual(extract_latest_message_from_content("Just a plain message"), ("Just a plain message", False))
+
+    def test_bot_sender_is_detected_without_parsing(self):
+        content = _entry("Ayşe", "<div>Hi</div>") + _entry("You", "<div>Hello, how can I help?</div>")
+        self.assertTrue(_is_bot_message_fast(content))
+        self.assertEqual(extract_latest_message_from_content(content), (None, True))
+        # The full parse agrees with the tail scan
+        self.assertEqual(_extract_latest_message(content), ("Hello, how can I help?", True))
+
+    def test_only_the_last_entry_decides_the_sender(self):
+        content = _entry("You", "<div>Hello</div>") + _entry("Ayşe", "<div>Thanks</div>")
+        self.assertFalse(_is_bot_message_fast(content))
+        self.assertEqual(extract_latest_message_from_content(content), ("Thanks", False))
@@ -0,0 +1,62 @@
+# frappe_ai/utils.py
+
+import frappe
+import threading
+import requests
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+OPENROUTER_CHAT_COMPLETIONS_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# Endpoints whose TLS connections are opened ahead of the first real call.
+# Chat completions have their own adapter (and pool), so that is the one warmed.
+PRE_WARM_URLS = (OPENROUTER_CHAT_COMPLETIONS_URL,)
+
+_pre_warm_started = False
+
+
+@lru_cache(maxsize=1)
+def get_openrouter_session() -> requests.Session:
+    """
+    Returns the worker's shared OpenRouter session, so LLM and key-management
+    calls reuse pooled keep-alive TLS connections. Connection failures are
+    retried with backoff; status retries only apply to idempotent methods, so
+    POSTs are never replayed. Chat completions get an adapter without retries
+    because their caller (`_post_with_retries`) runs its own retry loop.
+    """
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries))
+    session.mount(OPENROUTER_CHAT_COMPLETIONS_URL, HTTPAdapter(pool_connections=1, pool_maxsize=20, max_retries=0))
+    return session
+
+
+def pre_warm_connections():
+    """
+    `before_request` hook. On the first request a web worker serves for a site
+    with AI enabled and a provisioned key, opens the pooled OpenRouter
+    connection in a background thread so the first LLM call skips the TCP +
+    TLS handshake. Later calls are no-ops. Not used for jobs: RQ forks a fresh
+    process per job, so a warmed socket would die with it.
+    """
+    global _pre_warm_started
+    if _pre_warm_started:
+        return
+    if not (
+        frappe.db.get_single_value("AI Setting", "enable_ai", cache=True)
+        and frappe.db.get_single_value("AI Setting", "key_provisioned", cache=True)
+    ):
+        return
+    _pre_warm_started = True
+    threading.Thread(target=_warm_connections, name="frappe-ai-pre-warm", daemon=True).start()
+
+
+def _warm_connections():
+    session = get_openrouter_session()
+    for url in PRE_WARM_URLS:
+        try:
+            session.head(url, timeout=5)
+        except requests.exceptions.RequestException:
+            # Best effort only: the real call will connect on its own.
+            pass